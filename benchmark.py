@@ -0,0 +1,351 @@
+import contextlib
+import io
+import pickle
+import os
+import tempfile
+import timeit
+import tracemalloc
+import numpy as np
+from objloader import loadOBJ,loadIndexedOBJ
+from vboindexer import indexVBO,weldVBO
+from meshoptimizer import *
+from meshsimplifier import buildLODChain
+from meshlets import buildMeshlets,cullMeshlets
+from controls import glm_perspective,glm_lookAt
+from vertexencoding import encodingErrors,printEncodingErrors,normalEncodings
+from s3tc import encodeS3TC,decodeS3TC
+from texturecompressor import psnr
+from textures import readBMP
+from mipmaps import buildMipmaps,filters
+
+# Benchmarks of the mesh loading path on the bundled meshes.
+# Each vectorized function is timed against a plain Python reference
+# implementation kept here, and both results are checked to be identical.
+
+MESHES = ["cube.obj", "suzanne.obj", "room_thickwalls.obj"]
+
+def referenceLoadOBJ(path, invert_v=False):
+
+    # The original line by line loader
+    temp_vertices,temp_uvs,temp_normals,indices = [],[],[],[]
+
+    f = open(path,'r')
+    for l in f:
+
+        # read the first word of the line
+        ls = l.split()
+        if len(ls)==0 or l[0]=='#': continue
+        lineHeader = ls[0]
+
+        if lineHeader=="v":
+            temp_vertices.append([float(i) for i in ls[1:4]])
+        elif lineHeader=="vt":
+            temp_uvs.append([float(i) for i in ls[1:3]])
+            if invert_v: temp_uvs[-1][1] *= -1.
+        elif lineHeader=="vn":
+            temp_normals.append([float(i) for i in ls[1:4]])
+        elif lineHeader=="f":
+            for ll in ls[1:]:
+                indices.append([int(i) for i in ll.split('/')])
+    f.close()
+
+    out_vertices,out_uvs,out_normals = [],[],[]
+
+    for i in indices:
+        out_vertices.append( temp_vertices[ i[0]-1 ] )
+        out_uvs     .append( temp_uvs[ i[1]-1 ] )
+        out_normals .append( temp_normals[ i[2]-1 ] )
+
+    # Shaped explicitly, for the files without faces
+    return (
+            np.array(out_vertices,dtype=np.float32).reshape(-1,3),
+            np.array(out_uvs,dtype=np.float32).reshape(-1,2),
+            np.array(out_normals,dtype=np.float32).reshape(-1,3)
+            )
+
+def referenceIndexVBO(in_vertices,in_uvs,in_normals):
+
+    # The original indexer, hashing every vertex with pickle
+    VertexToOutIndex = {}
+    out_vertices,out_uvs,out_normals,out_indices = [],[],[],[]
+
+    for i in range(len(in_vertices)):
+
+        packed = pickle.dumps([in_vertices[i], in_uvs[i], in_normals[i]])
+
+        if packed in VertexToOutIndex.keys():
+            out_indices.append( VertexToOutIndex[packed] )
+        else:
+            out_vertices.append( in_vertices[i] )
+            out_uvs     .append( in_uvs[i] )
+            out_normals .append( in_normals[i] )
+            newindex = np.uint16( len(out_vertices) - 1 )
+            out_indices .append( newindex )
+            VertexToOutIndex[ packed ] = newindex
+
+    return np.array(out_indices),np.array(out_vertices),np.array(out_uvs),np.array(out_normals)
+
+def bench(function, number=5):
+    # Best time of a few runs, in milliseconds. The loaders' progress
+    # messages are swallowed so they don't drown the results.
+    with contextlib.redirect_stdout(io.StringIO()):
+        return 1000.0*min(timeit.repeat(function, number=1, repeat=number))
+
+def sameArrays(a, b):
+    return len(a)==len(b) and all(x.dtype==y.dtype and np.array_equal(x,y) for x,y in zip(a,b))
+
+# Unusual but valid OBJ input, which loadOBJ must read as the original
+# loader did
+PARSER_CASES = {
+    "trailing comments": "v 1 0 0 # a\nv 0 1 0\nv 0 0 1 #\nvt 0 0 # b 1\nvt 1 0\nvt 0 1\n"
+        "vn 0 0 1 #c\nf 1/1/1 2/2/1 3/3/1\n",
+    "indented lines": "  v 1 0 0\n\tv 0 1 0\n \t v 0 0 1\n  # note\n vt 0 0\n\tvt 1 0\nvt 0 1\n"
+        "   \n\tvn 0 0 1\n\tf 1/1/1 2/2/1 3/3/1\n  f 3/3/1 2/2/1 1/1/1\n",
+    "extra components": "v 1 0 0 1\nv 0 1 0 1\nv 0 0 1 1\nvt 0 0 0\nvt 1 0 0\nvt 0 1 0\n"
+        "vn 0 0 1\nf 1/1/1 2/2/1 3/3/1\n",
+    "no faces": "v 1 0 0\nv 0 1 0\nvt 0 0\nvn 0 0 1\n",
+    }
+
+def checkParser():
+
+    print("loadOBJ on unusual input")
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "case.obj")
+    for name,text in PARSER_CASES.items():
+        with open(path,'w') as f: f.write(text)
+        reference = referenceLoadOBJ(path)
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = loadOBJ(path)
+        assert sameArrays(reference, result), "loadOBJ differs on {:}".format(name)
+        # loadIndexedOBJ gives what indexVBO gives on the triangles of loadOBJ
+        with contextlib.redirect_stdout(io.StringIO()):
+            indexed = loadIndexedOBJ(path)
+        assert sameArrays(indexVBO(*result), indexed), "loadIndexedOBJ differs on {:}".format(name)
+        indices = weldVBO(*result)[0]
+        assert len(indices)==len(result[0]), "weldVBO drops indices on {:}".format(name)
+        print("  {:<20} ok".format(name))
+    os.remove(path)
+    os.rmdir(directory)
+
+def benchLoadOBJ():
+
+    print("loadOBJ")
+    for path in MESHES:
+        reference = referenceLoadOBJ(path, invert_v=True)
+        result = loadOBJ(path, invert_v=True)
+        assert sameArrays(reference, result), "loadOBJ differs on {:}".format(path)
+
+        t_reference = bench(lambda: referenceLoadOBJ(path, invert_v=True))
+        t_result = bench(lambda: loadOBJ(path, invert_v=True))
+        print("  {:<20} reference {:9.3f} ms   vectorized {:9.3f} ms   speedup {:6.1f}x"
+                .format(path, t_reference, t_result, t_reference/t_result))
+
+def benchIndexVBO():
+
+    print("indexVBO")
+    for path in MESHES:
+        arrays = loadOBJ(path, invert_v=True)
+        reference = referenceIndexVBO(*arrays)
+        result = indexVBO(*arrays)
+        assert sameArrays(reference, result), "indexVBO differs on {:}".format(path)
+
+        t_reference = bench(lambda: referenceIndexVBO(*arrays))
+        t_result = bench(lambda: indexVBO(*arrays))
+        print("  {:<20} reference {:9.3f} ms   vectorized {:9.3f} ms   speedup {:6.1f}x"
+                .format(path, t_reference, t_result, t_reference/t_result))
+
+def peakMemory(function):
+    # Largest amount of memory allocated while function runs, in MB
+    with contextlib.redirect_stdout(io.StringIO()):
+        tracemalloc.start()
+        try:
+            function()
+            return tracemalloc.get_traced_memory()[1]/1e6
+        finally: tracemalloc.stop()
+
+def benchLoadIndexedOBJ(copies=100):
+
+    print("loadIndexedOBJ (and a file of {:} copies of room_thickwalls.obj)".format(copies))
+    large = os.path.join(tempfile.mkdtemp(), "large.obj")
+    writeLargeOBJ(large, copies)
+
+    for path in MESHES+[large]:
+        with contextlib.redirect_stdout(io.StringIO()):
+            reference = indexVBO(*loadOBJ(path, invert_v=True))
+            result = loadIndexedOBJ(path, invert_v=True)
+        if path in MESHES:
+            assert sameArrays(referenceIndexVBO(*loadOBJ(path, invert_v=True)), reference)
+        assert sameArrays(reference, result), "loadIndexedOBJ differs on {:}".format(path)
+
+        t_reference = bench(lambda: indexVBO(*loadOBJ(path, invert_v=True)), number=3)
+        t_result = bench(lambda: loadIndexedOBJ(path, invert_v=True), number=3)
+        m_reference = peakMemory(lambda: indexVBO(*loadOBJ(path, invert_v=True)))
+        m_result = peakMemory(lambda: loadIndexedOBJ(path, invert_v=True))
+        print("  {:<20} indexVBO(loadOBJ) {:9.3f} ms {:7.1f} MB   loadIndexedOBJ {:9.3f} ms {:7.1f} MB   speedup {:4.1f}x"
+                .format(os.path.basename(path), t_reference, m_reference, t_result, m_result, t_reference/t_result))
+
+    os.remove(large)
+    os.rmdir(os.path.dirname(large))
+
+def sameTriangles(indices_a, indices_b):
+    # Same triangles, with the same winding, in any order
+    def triangles(indices):
+        t = np.asarray(indices,dtype=np.int64).reshape(-1,3)
+        # Rotate each triangle so that it starts with its smallest index
+        t = np.take_along_axis(t, (np.arange(3)+np.argmin(t,axis=1)[:,None])%3, axis=1)
+        return t[np.lexsort(t.T[::-1])]
+    return np.array_equal(triangles(indices_a), triangles(indices_b))
+
+def benchVertexCache():
+
+    print("optimizeVertexCache (FIFO cache of 16 vertices)")
+    for path in MESHES[1:]:
+        with contextlib.redirect_stdout(io.StringIO()):
+            indices,vertices,uvs,normals = loadIndexedOBJ(path)
+        optimized = optimizeVertexCache(indices, len(vertices))
+        assert sameTriangles(indices, optimized), "optimizeVertexCache changed the triangles of {:}".format(path)
+
+        t = bench(lambda: optimizeVertexCache(indices, len(vertices)))
+        before,after = analyzeVertexCache(indices, len(vertices)),analyzeVertexCache(optimized, len(vertices))
+        print("  {:<20} ACMR {:.3f} -> {:.3f}   ATVR {:.3f} -> {:.3f}   {:9.3f} ms"
+                .format(path, before[0], after[0], before[1], after[1], t))
+
+def sameGeometry(mesh_a, mesh_b):
+    # Same triangles once de-indexed, corners in the same order, triangles
+    # in any order
+    def triangles(indices, *attributes):
+        t = np.concatenate([a[indices] for a in attributes],axis=1).reshape(len(indices)//3,-1)
+        return t[np.lexsort(t.T[::-1])]
+    return np.array_equal(triangles(*mesh_a), triangles(*mesh_b))
+
+def benchVertexFetch():
+
+    print("optimizeOverdraw + optimizeVertexFetch (after optimizeVertexCache)")
+    for path in MESHES[1:]:
+        with contextlib.redirect_stdout(io.StringIO()):
+            mesh = loadIndexedOBJ(path)
+        indices,vertices = mesh[0],mesh[1]
+        cached = optimizeVertexCache(indices, len(vertices))
+        overdraw = optimizeOverdraw(cached, vertices)
+        optimized = optimizeVertexFetch(overdraw, *mesh[1:])
+        assert sameGeometry(mesh, optimized), "The optimizations changed the geometry of {:}".format(path)
+
+        t = bench(lambda: optimizeVertexFetch(optimizeOverdraw(cached, vertices), *mesh[1:]))
+        # Overfetch of the original order, against the final one
+        print("  {:<20} ACMR {:.3f} -> {:.3f}   overfetch {:.3f} -> {:.3f}   {:9.3f} ms"
+                .format(path, analyzeVertexCache(cached)[0], analyzeVertexCache(optimized[0])[0],
+                    analyzeVertexFetch(indices), analyzeVertexFetch(optimized[0]), t))
+
+def benchLODChain(levels=6):
+
+    print("buildLODChain ({:} levels)".format(levels))
+    for path in MESHES[1:]:
+        with contextlib.redirect_stdout(io.StringIO()):
+            mesh = loadIndexedOBJ(path)
+        lods = buildLODChain(*mesh, levels=levels)
+        t = bench(lambda: buildLODChain(*mesh, levels=levels), number=3)
+        print("  {:<20} {:9.3f} ms   triangles (error) {:}".format(path, t,
+            "  ".join("{:}({:.3f})".format(len(indices)//3, error) for indices,error in lods)))
+
+def benchMeshlets(views=64):
+
+    print("buildMeshlets + cullMeshlets ({:} views around the mesh)".format(views))
+    ProjectionMatrix = glm_perspective(np.radians(45.0), 4.0/3.0, 0.1, 100.0)
+    angles = np.linspace(0., 2.*np.pi, views, endpoint=False)
+    cameras = [glm_lookAt([5.*np.sin(a),1.,5.*np.cos(a)], [np.sin(3.*a),0.,0.], [0,1,0]) for a in angles]
+
+    for path in MESHES[1:]:
+        with contextlib.redirect_stdout(io.StringIO()):
+            indices,vertices,uvs,normals = loadIndexedOBJ(path)
+        indices = optimizeVertexCache(indices, len(vertices))
+        indices,meshlets = buildMeshlets(indices, vertices)
+
+        t_build = bench(lambda: buildMeshlets(indices, vertices))
+        t_cull = bench(lambda: [cullMeshlets(meshlets, V, ProjectionMatrix) for V in cameras])/views
+        drawn = np.mean([meshlets['count'][cullMeshlets(meshlets, V, ProjectionMatrix)].sum() for V in cameras])
+        print("  {:<20} {:4} meshlets   build {:9.3f} ms   cull {:7.3f} ms   triangles drawn {:5.1f}%"
+                .format(path, len(meshlets), t_build, t_cull, 100.*drawn/len(indices)))
+
+def benchVertexEncoding():
+
+    print("Vertex encodings (float16 positions, unorm16 UVs)")
+    for path in MESHES[1:]:
+        with contextlib.redirect_stdout(io.StringIO()):
+            indices,vertices,uvs,normals = loadIndexedOBJ(path)
+        print("  {:}".format(path))
+        for normalEncoding in normalEncodings[2:]:
+            printEncodingErrors(encodingErrors(vertices, uvs, normals, normalEncoding=normalEncoding))
+
+def benchS3TC():
+
+    print("encodeS3TC + decodeS3TC (uvtemplate.bmp, 512x512)")
+    with contextlib.redirect_stdout(io.StringIO()):
+        image = np.ascontiguousarray(readBMP("uvtemplate.bmp", rgb=True))
+    for fourCC in (b'DXT1', b'DXT5'):
+        data = encodeS3TC(fourCC, image)
+        decoded = decodeS3TC(fourCC, data, image.shape[1], image.shape[0])
+        t_encode = bench(lambda: encodeS3TC(fourCC, image), number=3)
+        t_decode = bench(lambda: decodeS3TC(fourCC, data, image.shape[1], image.shape[0]))
+        print("  {:<20} encode {:9.3f} ms   decode {:9.3f} ms   PSNR {:6.2f} dB"
+                .format(fourCC.decode(), t_encode, t_decode, psnr(image, decoded[...,:3])))
+
+def benchMipmaps():
+
+    print("buildMipmaps (uvtemplate.bmp, 512x512)")
+    with contextlib.redirect_stdout(io.StringIO()):
+        image = np.ascontiguousarray(readBMP("uvtemplate.bmp"))
+    for filter in filters:
+        for gamma in (False,True):
+            t = bench(lambda: buildMipmaps(image, filter, gamma))
+            print("  {:<20} {:9.3f} ms".format(filter+(" gamma" if gamma else ""), t))
+
+def writeLargeOBJ(path, copies):
+
+    # Concatenate copies of room_thickwalls.obj, shifting the face indices
+    src = open("room_thickwalls.obj").read().split('\n')
+    counts = [sum(l.startswith(k+' ') for l in src) for k in ("v","vt","vn")]
+    out = open(path,'w')
+    for k in range(copies):
+        for l in src:
+            if l.startswith('f '):
+                l = 'f '+' '.join('/'.join(str(int(i)+k*n) for i,n in zip(c.split('/'),counts))
+                        for c in l.split()[1:])
+            out.write(l+'\n')
+    out.close()
+
+def benchParallelLoadOBJ(copies=200):
+
+    path = os.path.join(tempfile.mkdtemp(), "large.obj")
+    writeLargeOBJ(path, copies)
+    print("loadOBJ(processes=...) on {:} copies of room_thickwalls.obj ({:.1f} MB)"
+            .format(copies, os.path.getsize(path)/1e6))
+
+    reference = loadOBJ(path)
+    t_serial = bench(lambda: loadOBJ(path), number=3)
+    print("  processes  1   {:9.3f} ms".format(t_serial))
+    for processes in sorted({2, 4, os.cpu_count()}-{1}):
+        assert sameArrays(reference, loadOBJ(path, processes=processes))
+        t = bench(lambda: loadOBJ(path, processes=processes), number=3)
+        print("  processes {:2}   {:9.3f} ms   speedup {:6.1f}x".format(processes, t, t_serial/t))
+
+    os.remove(path)
+    os.rmdir(os.path.dirname(path))
+
+def main():
+
+    checkParser()
+    benchLoadOBJ()
+    benchParallelLoadOBJ()
+    benchIndexVBO()
+    benchLoadIndexedOBJ()
+    benchVertexCache()
+    benchVertexFetch()
+    benchLODChain()
+    benchMeshlets()
+    benchVertexEncoding()
+    benchS3TC()
+    benchMipmaps()
+
+if __name__ == "__main__":
+
+    main()
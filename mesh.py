@@ -0,0 +1,91 @@
+from OpenGL.GL import *
+import ctypes
+import numpy as np
+from meshcache import loadIndexedOBJCached
+from vboindexer import indexType,interleave
+
+# An indexed mesh on the GPU. The vertex and index buffers are uploaded
+# once, and the attribute setup is recorded once in a vertex array object,
+# so drawing the mesh takes 2 GL calls per frame :
+#
+#   mesh = loadMesh("suzanne.obj", invert_v=True)
+#   while ...:
+#       mesh.draw()
+#   mesh.close()
+
+# Attribute location of each field of the interleaved vertices, as in the
+# layout(location = ...) of the shaders
+defaultLocations = {"position": 0, "uv": 1, "normal": 2}
+
+def _attributeFormat(dtype, shape):
+    # (size, type, normalized) of a field of the interleaved vertices.
+    # Integer fields are normalized, see vertexencoding.py.
+    size = int(np.prod(shape)) if shape else 1
+    if dtype==np.float32: return size,GL_FLOAT,False
+    if dtype==np.float16: return size,GL_HALF_FLOAT,False
+    if dtype==np.uint16: return size,GL_UNSIGNED_SHORT,True
+    if dtype==np.int16: return size,GL_SHORT,True
+    if dtype==np.uint32 and size==1: return 4,GL_INT_2_10_10_10_REV,True
+    raise RuntimeError("No vertex attribute format for {:}x{:}".format(dtype, size))
+
+class Mesh:
+    def __init__(self, indices, vertices, locations=defaultLocations):
+        # indices from indexVBO, and vertices interleaved as indexVBO(...,
+        # interleaved=True) returns them, or a tuple (vertices, uvs, normals)
+        # to interleave. locations maps the fields of the vertices to
+        # attribute locations ; other fields are left out.
+        if isinstance(vertices, (tuple,list)): vertices = interleave(*vertices)
+        indices = np.ascontiguousarray(indices)
+        vertices = np.ascontiguousarray(vertices)
+        if vertices.dtype.names is None:
+            raise RuntimeError("Mesh needs interleaved vertices")
+
+        self.count = len(indices)
+        self.indexType = indexType(indices)
+        self.indexSize = indices.itemsize
+        self.vertexCount = len(vertices)
+
+        self.vao = glGenVertexArrays(1)
+        glBindVertexArray(self.vao)
+
+        self.vbo = glGenBuffers(1)
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        glBufferData(GL_ARRAY_BUFFER, vertices.nbytes, vertices, GL_STATIC_DRAW)
+
+        # The element array binding is part of the VAO state
+        self.ibo = glGenBuffers(1)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.ibo)
+        glBufferData(GL_ELEMENT_ARRAY_BUFFER, indices.nbytes, indices, GL_STATIC_DRAW)
+
+        for name,location in locations.items():
+            if name not in vertices.dtype.names: continue
+            dtype,offset = vertices.dtype.fields[name][:2]
+            size,glType,normalized = _attributeFormat(dtype.base, dtype.shape)
+            glEnableVertexAttribArray(location)
+            glVertexAttribPointer(location, size, glType, normalized,
+                    vertices.itemsize, ctypes.c_void_p(offset))
+
+        glBindVertexArray(0)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def draw(self, first=0, count=None):
+        # Draws count indices from the index first, all of them by default.
+        # Ranges of meshletRanges or levels of buildLODChain sharing the
+        # same vertices can be drawn this way.
+        if count is None: count = self.count-first
+        glBindVertexArray(self.vao)
+        glDrawElements(GL_TRIANGLES, count, self.indexType,
+                ctypes.c_void_p(first*self.indexSize))
+
+    def close(self):
+        # Deletes the GL objects ; the mesh can't be drawn anymore
+        if self.vao is None: return
+        glDeleteVertexArrays(1, [self.vao])
+        glDeleteBuffers(2, [self.vbo, self.ibo])
+        self.vao = self.vbo = self.ibo = None
+
+def loadMesh(path, invert_v=False, locations=defaultLocations):
+    # Loads an .obj file through the mesh cache, already indexed and
+    # interleaved, and uploads it
+    indices,vertices = loadIndexedOBJCached(path, invert_v=invert_v, interleaved=True)
+    return Mesh(indices, vertices, locations)
@@ -0,0 +1,169 @@
+import hashlib
+import os
+import shutil
+import numpy as np
+from objloader import loadOBJ,loadIndexedOBJ
+
+# On-disk cache of parsed meshes.
+#
+# The first time a mesh is loaded, the arrays are saved as raw .npy files in
+# a directory of the cache. The next loads memory-map them back, so nothing
+# is parsed and only the pages actually used are read from the disk.
+#
+# The cache has two levels :
+# - a small ".ref" file per (path, size, mtime) of the source, which points to
+# - an entry directory named after a hash of the source content.
+# A source which is touched without being modified (a fresh checkout...) is
+# hashed again and finds its old entry. Entries are evicted, least recently
+# used first, when the cache grows bigger than maxCacheSize.
+#
+# The arrays are mapped copy-on-write : they can be modified in place like
+# the ones loadOBJ returns, without the changes going back to the cache.
+#
+# Entries are keyed by formatVersion as well : bump it whenever the loaders
+# or the layout of the entries change, so that old entries are not served.
+
+formatVersion = 1
+
+cacheDir = os.environ.get("MESH_CACHE_DIR", ".meshcache")
+maxCacheSize = 512*1024*1024 # 512 MB
+
+def setCacheDir(path):
+    global cacheDir
+    cacheDir = path
+
+def setMaxCacheSize(nbytes):
+    global maxCacheSize
+    maxCacheSize = nbytes
+    evict()
+
+def _hashFile(path, h):
+    f = open(path,'rb')
+    for block in iter(lambda: f.read(1<<20), b''): h.update(block)
+    f.close()
+    return h.hexdigest()
+
+def _refPath(path, tag):
+    # Cheap key : only stats the source
+    st = os.stat(path)
+    key = repr((os.path.abspath(path), st.st_size, st.st_mtime_ns, tag))
+    return os.path.join(cacheDir, hashlib.sha1(key.encode()).hexdigest()+".ref")
+
+def _readRef(ref):
+    # A reference holds the entry name and the absolute path of its source.
+    # A missing or malformed one is a miss.
+    try: f = open(ref,'r')
+    except OSError: return None,None
+    lines = f.read().split('\n',1)
+    f.close()
+    if len(lines)!=2 or not lines[0]: return None,None
+    return lines[0],lines[1]
+
+def _writeRef(ref, entry, path):
+    # Write then rename, so that an interrupted write, or a process reading
+    # the reference meanwhile, never sees a partial one
+    tmpPath = ref+".tmp{:}".format(os.getpid())
+    f = open(tmpPath,'w')
+    f.write(entry+'\n'+os.path.abspath(path))
+    f.close()
+    os.replace(tmpPath, ref)
+
+def _loadEntry(entry):
+    entryPath = os.path.join(cacheDir, entry)
+    try: names = sorted(n for n in os.listdir(entryPath) if n.endswith(".npy"))
+    except OSError: return None
+    # Touch the entry, it is now the most recently used one
+    os.utime(entryPath)
+    return tuple(np.load(os.path.join(entryPath,n), mmap_mode='c') for n in names)
+
+def _saveEntry(entry, arrays):
+    # Write in a temporary directory then rename it, so that an interrupted
+    # save never leaves a half written entry behind
+    entryPath = os.path.join(cacheDir, entry)
+    tmpPath = entryPath+".tmp{:}".format(os.getpid())
+    os.makedirs(tmpPath)
+    for i,a in enumerate(arrays):
+        np.save(os.path.join(tmpPath,"{:02}.npy".format(i)), np.ascontiguousarray(a))
+    try: os.rename(tmpPath, entryPath)
+    except OSError: shutil.rmtree(tmpPath) # Another process was faster
+
+def cachedMesh(path, tag, build):
+    # Returns the arrays build() returns for the source file path, from the
+    # cache when possible. tag names build() and its arguments.
+    if not os.path.isfile(path):
+        raise RuntimeError("Impossible to open the file! Are you in the right path?"
+        " See Tutorial 1 for details")
+    os.makedirs(cacheDir, exist_ok=True)
+    tag = "format={:} {:}".format(formatVersion, tag)
+
+    ref = _refPath(path, tag)
+    entry,source = _readRef(ref)
+    arrays = _loadEntry(entry) if entry is not None else None
+
+    if arrays is None:
+        # Unknown (path, size, mtime) : look the content up
+        entry = _hashFile(path, hashlib.sha1(tag.encode()+b'\0'))
+        arrays = _loadEntry(entry)
+        if arrays is None:
+            _saveEntry(entry, build())
+            evict(keep=entry)
+            arrays = _loadEntry(entry)
+        _writeRef(ref, entry, path)
+
+    return arrays
+
+def loadOBJCached(path, invert_v=False, interleaved=False):
+    print("Loading OBJ file {:} through the mesh cache...".format(path))
+    if interleaved:
+        return cachedMesh(path, "loadOBJ invert_v={:} interleaved".format(invert_v),
+                lambda: (loadOBJ(path, invert_v=invert_v, interleaved=True),))[0]
+    return cachedMesh(path, "loadOBJ invert_v={:}".format(invert_v),
+            lambda: loadOBJ(path, invert_v=invert_v))
+
+def loadIndexedOBJCached(path, invert_v=False, interleaved=False):
+    print("Loading indexed OBJ file {:} through the mesh cache...".format(path))
+    tag = "loadIndexedOBJ invert_v={:}".format(invert_v)+(" interleaved" if interleaved else "")
+    return cachedMesh(path, tag,
+            lambda: loadIndexedOBJ(path, invert_v=invert_v, interleaved=interleaved))
+
+def _entries():
+    # (last use, size, name) of every entry of the cache
+    entries = []
+    for name in os.listdir(cacheDir):
+        entryPath = os.path.join(cacheDir, name)
+        if not os.path.isdir(entryPath) or ".tmp" in name: continue
+        size = sum(os.path.getsize(os.path.join(entryPath,n)) for n in os.listdir(entryPath))
+        entries.append((os.stat(entryPath).st_mtime, size, name))
+    return entries
+
+def _removeEntry(name):
+    shutil.rmtree(os.path.join(cacheDir, name), ignore_errors=True)
+    # Drop the references pointing to it as well
+    for ref in os.listdir(cacheDir):
+        if not ref.endswith(".ref"): continue
+        if _readRef(os.path.join(cacheDir, ref))[0]==name:
+            os.remove(os.path.join(cacheDir, ref))
+
+def evict(keep=None):
+    # Remove the least recently used entries until the cache fits in
+    # maxCacheSize. The entry keep is never removed.
+    if not os.path.isdir(cacheDir): return
+    entries = sorted(_entries())
+    total = sum(e[1] for e in entries)
+    for lastUse,size,name in entries:
+        if total<=maxCacheSize: break
+        if name==keep: continue
+        _removeEntry(name)
+        total -= size
+
+def invalidate(path=None):
+    # Forget the cached meshes of the source file path, or the whole cache
+    if not os.path.isdir(cacheDir): return
+    if path is None:
+        shutil.rmtree(cacheDir, ignore_errors=True)
+        return
+    path = os.path.abspath(path)
+    for ref in os.listdir(cacheDir):
+        if not ref.endswith(".ref"): continue
+        entry,source = _readRef(os.path.join(cacheDir, ref))
+        if source==path: _removeEntry(entry)
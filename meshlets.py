@@ -0,0 +1,162 @@
+import numpy as np
+
+# Splitting of indexed meshes, as returned by indexVBO, into small clusters
+# of triangles (meshlets) which can be culled one by one on the CPU :
+#
+#   indices,vertices,uvs,normals = indexVBO(*loadOBJ("room_thickwalls.obj"))
+#   indices = optimizeVertexCache(indices, len(vertices))
+#   indices,meshlets = buildMeshlets(indices, vertices)
+#   ...
+#   visible = cullMeshlets(meshlets, controls.ViewMatrix, controls.ProjectionMatrix)
+#   for first,count in meshletRanges(meshlets, visible):
+#       glDrawElements(GL_TRIANGLES, count, indexType(indices),
+#               ctypes.c_void_p(first*indices.itemsize))
+#
+# The triangles of a meshlet are contiguous in the returned indices, so a
+# meshlet is drawn with a single glDrawElements, and neighbor visible
+# meshlets with a single one too.
+#
+# Each meshlet has a bounding sphere and box, for frustum culling, and a
+# cone bounding the normals of its triangles, for backface culling : when
+# the camera sees all the triangles from behind, the whole meshlet can go.
+
+meshletDtype = np.dtype([
+    ('offset', np.uint32),        # first index of the meshlet in the indices
+    ('count', np.uint32),         # number of indices (3 per triangle)
+    ('vertex_count', np.uint32),  # number of different vertices
+    ('center', np.float32, 3),    # bounding sphere
+    ('radius', np.float32),
+    ('min', np.float32, 3),       # bounding box
+    ('max', np.float32, 3),
+    ('cone_axis', np.float32, 3), # normal cone
+    ('cone_cutoff', np.float32),  # sine of its half angle, 1 if it can't cull
+    ])
+
+def _scan(triangles, vertex_count, max_vertices, max_triangles):
+    # Greedy scan : triangles go into the current meshlet until it would get
+    # more than max_vertices vertices or max_triangles triangles. The
+    # meshlets are as good as the locality of the triangle order.
+    # Returns the first triangle and the vertex count of every meshlet.
+    mark = [-1]*vertex_count
+    starts,vertexCounts = [0],[]
+    meshlet,vertices,count = 0,0,0
+
+    for i,(a,b,c) in enumerate(triangles.tolist()):
+        new = (mark[a]!=meshlet)+(mark[b]!=meshlet)+(mark[c]!=meshlet)
+        if vertices+new>max_vertices or count==max_triangles:
+            vertexCounts.append(vertices)
+            starts.append(i)
+            meshlet,vertices,count = meshlet+1,0,0
+        for v in (a,b,c):
+            if mark[v]!=meshlet:
+                mark[v] = meshlet
+                vertices += 1
+        count += 1
+
+    vertexCounts.append(vertices)
+    return np.array(starts, dtype=np.int64),np.array(vertexCounts, dtype=np.uint32)
+
+def _bounds(meshlets, triangles, positions, starts):
+    # Bounding box, sphere around the center of the box, and normal cone
+    # of the meshlets starting at the triangles starts
+    sizes = np.diff(np.concatenate((starts,[len(triangles)])))
+    corners = positions[triangles].reshape(-1,3)
+
+    low = np.minimum.reduceat(corners, 3*starts)
+    high = np.maximum.reduceat(corners, 3*starts)
+    center = 0.5*(low+high)
+    distance = np.linalg.norm(corners-np.repeat(center, 3*sizes, axis=0), axis=1)
+    meshlets['min'],meshlets['max'] = low,high
+    meshlets['center'] = center
+    meshlets['radius'] = np.maximum.reduceat(distance, 3*starts)
+
+    # The cone axis is the mean of the triangle normals, and its angle
+    # the largest one between the axis and a normal. Degenerate triangles
+    # are never drawn, so they don't count.
+    p = positions[triangles]
+    cross = np.cross(p[:,1]-p[:,0], p[:,2]-p[:,0])
+    length = np.linalg.norm(cross, axis=1)
+    degenerate = length==0
+    n = cross/np.where(degenerate,1.,length)[:,None]
+
+    axis = np.add.reduceat(n, starts)
+    axisLength = np.linalg.norm(axis, axis=1)
+    axis /= np.where(axisLength==0,1.,axisLength)[:,None]
+    dots = np.einsum('ij,ij->i', n, np.repeat(axis, sizes, axis=0))
+    minDot = np.minimum.reduceat(np.where(degenerate,1.,dots), starts)
+
+    # Cones wider than about 84 degrees hardly ever cull : turn them off
+    meshlets['cone_axis'] = axis
+    meshlets['cone_cutoff'] = np.where((minDot<=0.1)|(axisLength==0), 1.,
+            np.sqrt(np.maximum(1.-minDot**2,0.)))
+
+def buildMeshlets(indices, vertices, max_vertices=64, max_triangles=124):
+
+    # Splits the triangles into meshlets of at most max_vertices vertices and
+    # max_triangles triangles, in the order of the indices : reorder them
+    # with optimizeVertexCache first for tighter meshlets. The normal cones
+    # use the normals of the triangles, as backface culling does, not the
+    # vertex normals.
+    # Returns the indices, in the same type, and an array of meshletDtype.
+    indices = np.asarray(indices)
+    triangles = indices.reshape(-1,3)
+    if len(triangles)==0: return indices.copy(),np.zeros(0, dtype=meshletDtype)
+    if max_vertices<3 or max_triangles<1:
+        raise RuntimeError("A meshlet needs room for at least one triangle")
+
+    starts,vertexCounts = _scan(triangles, len(vertices), max_vertices, max_triangles)
+
+    meshlets = np.zeros(len(starts), dtype=meshletDtype)
+    meshlets['offset'] = 3*starts
+    meshlets['count'] = 3*np.diff(np.concatenate((starts,[len(triangles)])))
+    meshlets['vertex_count'] = vertexCounts
+    _bounds(meshlets, triangles, np.asarray(vertices, dtype=np.float64), starts)
+
+    return indices,meshlets
+
+def _frustumPlanes(MVP):
+    # Planes of the clip volume in model space : with row vectors,
+    # clip = [x,y,z,1].MVP and a point is inside when -w <= x,y,z <= w
+    c = MVP.T
+    planes = np.array([c[3]+c[0], c[3]-c[0], c[3]+c[1], c[3]-c[1], c[3]+c[2], c[3]-c[2]])
+    return planes/np.linalg.norm(planes[:,:3], axis=1)[:,None]
+
+def cullMeshlets(meshlets, ViewMatrix, ProjectionMatrix, ModelMatrix=None):
+
+    # Indices of the meshlets which may be visible : their bounding sphere
+    # touches the view frustum, and their normal cone does not face away
+    # from the camera. The model matrix should only rotate, translate and
+    # scale uniformly, or the normal cones no longer hold.
+    ModelView = np.asarray(ViewMatrix, dtype=np.float64)
+    if ModelMatrix is not None: ModelView = np.dot(ModelMatrix, ModelView)
+    MVP = np.dot(ModelView, ProjectionMatrix)
+
+    center = meshlets['center'].astype(np.float64)
+    radius = meshlets['radius'].astype(np.float64)
+
+    # Frustum test, on the 6 planes at once
+    planes = _frustumPlanes(MVP)
+    distances = np.dot(center, planes[:,:3].T)+planes[:,3]
+    visible = (distances>=-radius[:,None]).all(axis=1)
+
+    # Cone test : the camera, in model space, looks at the back of every
+    # triangle of the meshlet
+    camera = np.linalg.inv(ModelView)[3,:3]
+    toCenter = center-camera
+    backfacing = (np.einsum('ij,ij->i', toCenter, meshlets['cone_axis']) >
+            meshlets['cone_cutoff']*np.linalg.norm(toCenter,axis=1)+radius)
+
+    return np.flatnonzero(visible & ~backfacing)
+
+def meshletRanges(meshlets, visible):
+
+    # (first index, index count) of the runs of visible meshlets which
+    # follow each other in the indices, one glDrawElements each
+    visible = np.asarray(visible)
+    if len(visible)==0: return []
+    cut = np.flatnonzero(np.diff(visible)!=1)+1
+    first = visible[np.concatenate(([0],cut))]
+    last = visible[np.concatenate((cut-1,[len(visible)-1]))]
+    ends = meshlets['offset'][last].astype(np.int64)+meshlets['count'][last]
+    starts = meshlets['offset'][first].astype(np.int64)
+    return list(zip(starts.tolist(), (ends-starts).tolist()))
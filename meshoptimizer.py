@@ -0,0 +1,200 @@
+import numpy as np
+from vboindexer import indexArray
+
+# Mesh optimizations for indexed meshes, as returned by indexVBO :
+#
+#   indices,vertices,uvs,normals = indexVBO(*loadOBJ("suzanne.obj"))
+#   indices = optimizeVertexCache(indices, len(vertices))
+#   indices = optimizeOverdraw(indices, vertices)
+#   indices,vertices,uvs,normals = optimizeVertexFetch(indices, vertices, uvs, normals)
+#
+# The GPU keeps the last transformed vertices in a small cache. Drawing the
+# triangles in an order which reuses them avoids running the vertex shader
+# again for them. Drawing the triangles facing outwards first lets the
+# depth test reject more of the hidden fragments. Finally, storing the
+# vertices in the order they are first used makes their fetches read memory
+# mostly sequentially.
+
+def _vertexCount(indices, vertex_count):
+    if vertex_count is None: return int(indices.max())+1 if len(indices) else 0
+    return vertex_count
+
+def _adjacency(triangles, vertex_count):
+    # For every vertex, the list of the triangles using it (CSR layout)
+    corners = triangles.ravel()
+    order = np.argsort(corners, kind='stable')
+    offsets = np.zeros(vertex_count+1, dtype=np.int64)
+    np.cumsum(np.bincount(corners, minlength=vertex_count), out=offsets[1:])
+    return offsets,order//3
+
+def _cacheMisses(indices, vertex_count, cache_size):
+    # For every index, whether it misses a FIFO cache of cache_size vertices.
+    # A vertex is in the cache if it went in during the last cache_size misses.
+    entered = [-cache_size-1]*vertex_count
+    missed = []
+    misses = 0
+    for v in indices.tolist():
+        miss = misses-entered[v]>cache_size
+        if miss:
+            entered[v] = misses
+            misses += 1
+        missed.append(miss)
+    return np.array(missed, dtype=bool)
+
+def analyzeVertexCache(indices, vertex_count=None, cache_size=16):
+
+    # Simulates a FIFO post-transform cache of cache_size vertices.
+    # Returns the ACMR (transformed vertices per triangle, 0.5 at best on a
+    # regular mesh, 3 at worst) and the ATVR (transformed vertices per
+    # vertex of the mesh, 1 at best).
+    indices = np.asarray(indices)
+    vertex_count = _vertexCount(indices, vertex_count)
+    if len(indices)==0: return 0.,0.
+
+    misses = _cacheMisses(indices, vertex_count, cache_size).sum()
+    used = len(np.unique(indices))
+    return misses/(len(indices)/3.), misses/float(used)
+
+def optimizeVertexCache(indices, vertex_count=None, cache_size=16):
+
+    # Reorders the triangles for the post-transform cache with Tipsify
+    # (Sander, Nehab and Barczak, "Fast Triangle Reordering for Vertex
+    # Locality and Reduced Overdraw", 2007). Triangles are emitted by fans
+    # around a vertex, and the next fan vertex is picked among the vertices
+    # of the last fans which will still be in the cache.
+    # Returns the reordered indices, in the same type.
+    indices = np.asarray(indices)
+    vertex_count = _vertexCount(indices, vertex_count)
+    triangles = indices.reshape(-1,3)
+    if len(triangles)==0: return indices.copy()
+
+    offsets,adjacent = _adjacency(triangles, vertex_count)
+    offsets,adjacent = offsets.tolist(),adjacent.tolist()
+    corners = triangles.tolist()
+
+    live = np.bincount(triangles.ravel(), minlength=vertex_count).tolist()
+    timestamp = [0]*vertex_count
+    emitted = [False]*len(corners)
+    deadEnd = []
+    output = []
+
+    fan = 0
+    time = cache_size+1
+    cursor = 0
+
+    while fan>=0:
+
+        # Emit the remaining triangles around the fan vertex
+        candidates = []
+        for t in adjacent[offsets[fan]:offsets[fan+1]]:
+            if emitted[t]: continue
+            output.append(t)
+            emitted[t] = True
+            for v in corners[t]:
+                deadEnd.append(v)
+                candidates.append(v)
+                live[v] -= 1
+                if time-timestamp[v]>cache_size:
+                    timestamp[v] = time
+                    time += 1
+
+        # Next fan : the candidate which will stay in the cache the longest
+        # once its own fan is emitted...
+        fan,best = -1,-1
+        for v in candidates:
+            if live[v]<=0: continue
+            priority = 0
+            if time-timestamp[v]+2*live[v]<=cache_size: priority = time-timestamp[v]
+            if priority>best: fan,best = v,priority
+
+        if fan<0:
+            # ... or the last vertex emitted with triangles left ...
+            while deadEnd:
+                v = deadEnd.pop()
+                if live[v]>0:
+                    fan = v
+                    break
+        if fan<0:
+            # ... or the next vertex in order with triangles left
+            while cursor<vertex_count:
+                if live[cursor]>0:
+                    fan = cursor
+                    break
+                cursor += 1
+
+    return triangles[np.array(output)].ravel()
+
+def analyzeVertexFetch(indices, vertex_count=None, vertex_size=32, cache_size=16384, line_size=64):
+
+    # Simulates a FIFO cache of cache_size bytes, in lines of line_size bytes,
+    # in front of the vertex buffer. Returns the overfetch : bytes read from
+    # memory over the size of the vertices used (1 at best).
+    indices = np.asarray(indices)
+    if len(indices)==0: return 0.
+    lines = cache_size//line_size
+
+    # Lines spanned by each vertex
+    first = indices.astype(np.int64)*vertex_size//line_size
+    last = (indices.astype(np.int64)*vertex_size+vertex_size-1)//line_size
+    entered = {}
+    misses = 0
+    for a,b in zip(first.tolist(),last.tolist()):
+        for line in range(a,b+1):
+            if misses-entered.get(line,-lines-1)>lines:
+                entered[line] = misses
+                misses += 1
+
+    return misses*line_size/float(len(np.unique(indices))*vertex_size)
+
+def optimizeVertexFetch(indices, *attributes):
+
+    # Renumbers the vertices in the order the indices first use them, and
+    # permutes the attribute arrays (vertices, uvs, normals...) to match.
+    # Vertices no triangle uses are dropped.
+    # Returns the new indices followed by the new attribute arrays.
+    indices = np.asarray(indices)
+    used,first = np.unique(indices, return_index=True)
+    order = used[np.argsort(first)]
+
+    vertex_count = len(attributes[0]) if attributes else int(indices.max())+1
+    remap = np.zeros(vertex_count, dtype=np.int64)
+    remap[order] = np.arange(len(order))
+
+    return (indexArray(remap[indices], len(order)),)+tuple(np.asarray(a)[order] for a in attributes)
+
+def optimizeOverdraw(indices, vertices, vertex_count=None, cache_size=16):
+
+    # Reorders clusters of triangles so that the ones facing outwards are
+    # drawn first (Tipsify's overdraw pass). Clusters are cut where a
+    # triangle misses the vertex cache on all its corners, so the order
+    # inside them, and the cache efficiency, are kept. Call it after
+    # optimizeVertexCache.
+    indices = np.asarray(indices)
+    vertex_count = _vertexCount(indices, vertex_count)
+    triangles = indices.reshape(-1,3)
+    if len(triangles)==0: return indices.copy()
+
+    misses = _cacheMisses(indices, vertex_count, cache_size).reshape(-1,3).sum(axis=1)
+    starts = np.flatnonzero(misses==3)
+    if len(starts)==0 or starts[0]!=0: starts = np.concatenate(([0],starts))
+
+    # Area weighted centroid and normal of each cluster
+    p = np.asarray(vertices, dtype=np.float64)[triangles]
+    cross = np.cross(p[:,1]-p[:,0], p[:,2]-p[:,0])
+    area = np.linalg.norm(cross, axis=1)
+    centroid = p.mean(axis=1)
+
+    clusterArea = np.add.reduceat(area, starts)
+    clusterCentroid = np.add.reduceat(centroid*area[:,None], starts)/np.maximum(clusterArea,1e-30)[:,None]
+    clusterNormal = np.add.reduceat(cross, starts)
+    clusterNormal /= np.maximum(np.linalg.norm(clusterNormal,axis=1),1e-30)[:,None]
+
+    # Clusters far from the center and facing away from it first
+    meshCentroid = (centroid*area[:,None]).sum(axis=0)/max(area.sum(),1e-30)
+    key = np.einsum('ij,ij->i', clusterCentroid-meshCentroid, clusterNormal)
+    order = np.argsort(-key, kind='stable')
+
+    sizes = np.diff(np.concatenate((starts,[len(triangles)])))
+    firstOf = np.repeat(starts[order], sizes[order])
+    within = np.arange(len(triangles)) - np.repeat(np.cumsum(sizes[order])-sizes[order], sizes[order])
+    return triangles[firstOf+within].ravel()
@@ -0,0 +1,216 @@
+import numpy as np
+from vboindexer import indexArray,uniqueRows
+
+# Mesh simplification with quadric error metrics (Garland and Heckbert,
+# "Surface Simplification Using Quadric Error Metrics", 1997), for indexed
+# meshes as returned by indexVBO :
+#
+#   indices,vertices,uvs,normals = indexVBO(*loadOBJ("room_thickwalls.obj"))
+#   lods = buildLODChain(indices, vertices, uvs, normals, levels=4)
+#   level = selectLOD(lods, distance, controls.ProjectionMatrix)
+#   glDrawElements(GL_TRIANGLES, len(lods[level][0]), ...)
+#
+# Edges are collapsed onto one of their ends, so the simplified meshes only
+# use vertices of the original one : every level draws from the same vertex
+# buffers, and only the index buffer changes.
+#
+# UV and normal seams are kept : the copies of a vertex along a seam are
+# separate vertices sharing a position. A position may only collapse into
+# a neighbor position if every copy of it has a copy of the neighbor next
+# to it to merge into, so each side of the seam keeps its own attributes.
+
+def _planeQuadrics(triangles, positions):
+    # Quadric of the plane of each triangle, weighted by its area
+    p = positions[triangles]
+    cross = np.cross(p[:,1]-p[:,0], p[:,2]-p[:,0])
+    area = np.linalg.norm(cross, axis=1)
+    n = cross/np.maximum(area,1e-30)[:,None]
+    plane = np.concatenate((n, -np.einsum('ij,ij->i', n, p[:,0])[:,None]), axis=1)
+    return 0.5*area[:,None,None]*plane[:,:,None]*plane[:,None,:]
+
+def _quadricError(Q, p):
+    v = np.concatenate((p, np.ones((len(p),1))), axis=1)
+    return np.maximum(np.einsum('ni,nij,nj->n', v, Q, v), 0.)
+
+def _neighbors(edges_u, edges_v, count):
+    # CSR lists of the neighbors of every position
+    order = np.argsort(edges_u, kind='stable')
+    offsets = np.zeros(count+1, dtype=np.int64)
+    np.cumsum(np.bincount(edges_u, minlength=count), out=offsets[1:])
+    return offsets,edges_v[order]
+
+class _Simplifier:
+
+    def __init__(self, indices, vertices, uvs, normals, uv_weight, normal_weight):
+
+        self.triangles = np.asarray(indices, dtype=np.int64).reshape(-1,3)
+        self.vertex_count = len(vertices)
+        self.attributes = np.concatenate((
+            np.sqrt(uv_weight)*np.asarray(uvs, dtype=np.float64),
+            np.sqrt(normal_weight)*np.asarray(normals, dtype=np.float64)), axis=1)
+
+        # Vertices sharing a position form a group ; groups are what collapses
+        first,self.group = uniqueRows(np.asarray(vertices, dtype=np.float32))
+        self.position = np.asarray(vertices, dtype=np.float64)[first]
+        ngroups = len(first)
+
+        # Memoryful quadrics : a group keeps the quadrics of what collapsed into it
+        triangles = self.group[self.triangles]
+        self.Q = np.zeros((ngroups,4,4))
+        Kp = _planeQuadrics(triangles, self.position)
+        for c in range(3): np.add.at(self.Q, triangles[:,c], Kp)
+
+        # Positions on open borders never move
+        edges = np.sort(triangles[:,[0,1,1,2,2,0]].reshape(-1,2), axis=1)
+        edges,uses = np.unique(edges, axis=0, return_counts=True)
+        self.locked = np.zeros(ngroups, dtype=bool)
+        self.locked[edges[uses==1].ravel()] = True
+
+    def candidates(self):
+        # Every allowed collapse of a group U into a neighbor group V, with
+        # its cost and the vertex each vertex of U merges into
+        t,g = self.triangles,self.group
+        a = t[:,[0,1,2,1,2,0]].ravel()
+        b = t[:,[1,2,0,0,1,2]].ravel()
+        different = g[a]!=g[b]
+        a,b = a[different],b[different]
+
+        # One target per (vertex, neighbor group)
+        first,_ = uniqueRows(np.stack((a,g[b]),axis=1))
+        a,b = a[first],b[first]
+        U,V = g[a],g[b]
+
+        # The collapse is allowed if every vertex of U still used has a target
+        pairs,pair = np.unique(np.stack((U,V),axis=1), axis=0, return_inverse=True)
+        pair = pair.ravel()
+        used = np.unique(t)
+        size = np.bincount(g[used], minlength=len(self.position))
+        allowed = (np.bincount(pair, minlength=len(pairs))==size[pairs[:,0]]) & ~self.locked[pairs[:,0]]
+
+        # Geometric error, plus the attribute change of the merged vertices
+        cost = _quadricError(self.Q[pairs[:,0]]+self.Q[pairs[:,1]], self.position[pairs[:,1]])
+        cost += np.bincount(pair, weights=((self.attributes[a]-self.attributes[b])**2).sum(axis=1),
+                minlength=len(pairs))
+
+        keep = allowed[pair]
+        return pairs[allowed],cost[allowed],a[keep],b[keep],np.flatnonzero(allowed).searchsorted(pair[keep])
+
+    def flips(self, U, V):
+        # For each collapse U->V, whether it turns a triangle around. Each
+        # collapse is checked on its own : only one corner moves at a time.
+        g = self.group[self.triangles]
+        target = np.full(len(self.position), -1)
+        target[U] = V
+        bad = np.zeros(len(self.position), dtype=bool)
+
+        for c in range(3):
+            tg = g[target[g[:,c]]>=0]
+            moved = tg.copy()
+            moved[:,c] = target[tg[:,c]]
+            # Triangles collapsing entirely are fine
+            survives = (moved[:,0]!=moved[:,1])&(moved[:,1]!=moved[:,2])&(moved[:,2]!=moved[:,0])
+
+            p,q = self.position[tg],self.position[moved]
+            before = np.cross(p[:,1]-p[:,0], p[:,2]-p[:,0])
+            after = np.cross(q[:,1]-q[:,0], q[:,2]-q[:,0])
+            flipped = survives & (np.einsum('ij,ij->i', before, after)<=0)
+            bad[tg[flipped,c]] = True
+
+        return bad[U]
+
+    def collapse(self, target_count):
+        # One pass of independent collapses, cheapest first. Returns the
+        # error of the collapses made, or None if none could be made.
+        pairs,cost,a,b,pair = self.candidates()
+        if len(pairs)==0: return None
+
+        # Best collapse of each group, if it folds no triangle over
+        order = np.lexsort((cost,pairs[:,0]))
+        best = order[np.concatenate(([True],pairs[order[1:],0]!=pairs[order[:-1],0]))]
+        best = best[~self.flips(pairs[best,0],pairs[best,1])]
+        best = best[np.argsort(cost[best], kind='stable')]
+        if len(best)==0: return None
+
+        # Collapses must not touch each other's neighborhood in the same pass
+        g = self.group[self.triangles]
+        edges = g[:,[0,1,1,2,2,0,1,0,2,1,0,2]].reshape(-1,2)
+        offsets,neighbors = _neighbors(edges[:,0], edges[:,1], len(self.position))
+
+        # Only the cheapest part of the candidates in one pass, so that the
+        # order of the collapses stays close to the order of their costs
+        touched = np.zeros(len(self.position), dtype=bool)
+        needed = min((len(self.triangles)-target_count+1)//2, len(best)//8+1)
+        accepted = []
+        for i in best.tolist():
+            U,V = pairs[i]
+            if touched[U] or touched[V]: continue
+            nu = np.unique(neighbors[offsets[U]:offsets[U+1]])
+            nv = np.unique(neighbors[offsets[V]:offsets[V+1]])
+            # Link condition : an interior edge has two common neighbors
+            if len(np.intersect1d(nu,nv,assume_unique=True))>2: continue
+            accepted.append(i)
+            touched[U] = touched[V] = True
+            touched[nu] = True
+            if len(accepted)>=needed: break
+        if not accepted: return None
+        accepted = np.array(accepted)
+
+        # Merge the vertices and the quadrics, and drop the triangles left flat
+        merge = np.isin(pair, accepted)
+        remap = np.arange(self.vertex_count)
+        remap[a[merge]] = b[merge]
+        self.triangles = remap[self.triangles]
+        np.add.at(self.Q, pairs[accepted,1], self.Q[pairs[accepted,0]])
+        g = self.group[self.triangles]
+        flat = (g[:,0]==g[:,1])|(g[:,1]==g[:,2])|(g[:,2]==g[:,0])
+        self.triangles = self.triangles[~flat]
+
+        return float(np.sqrt(cost[accepted].max()))
+
+def simplifyMesh(indices, vertices, uvs, normals, target_count,
+        uv_weight=1.0, normal_weight=0.1):
+
+    # Collapses edges until the mesh has at most target_count triangles, or
+    # nothing more can collapse. Returns the new indices, drawing from the
+    # same vertices, and the error : the square root of the largest cost of
+    # the collapses, quadric error plus weighted attribute change, which is
+    # about a distance in model units.
+    simplifier = _Simplifier(indices, vertices, uvs, normals, uv_weight, normal_weight)
+    error = 0.
+    while len(simplifier.triangles)>target_count:
+        passError = simplifier.collapse(target_count)
+        if passError is None: break
+        error = max(error, passError)
+    return indexArray(simplifier.triangles.ravel(), len(vertices)),error
+
+def buildLODChain(indices, vertices, uvs, normals, levels=4, ratio=0.5,
+        uv_weight=1.0, normal_weight=0.1):
+
+    # Levels of detail from the full mesh (level 0) down, each one aiming at
+    # ratio times the triangles of the previous one. Returns a list of
+    # (indices, error), the error of a level including the previous ones.
+    # All the levels use the same vertices.
+    simplifier = _Simplifier(indices, vertices, uvs, normals, uv_weight, normal_weight)
+    lods = [(indexArray(np.asarray(indices).ravel(), len(vertices)), 0.)]
+    error = 0.
+
+    for level in range(1,levels):
+        target_count = int(len(simplifier.triangles)*ratio)
+        while len(simplifier.triangles)>target_count:
+            passError = simplifier.collapse(target_count)
+            if passError is None: break
+            error = max(error, passError)
+        lods.append((indexArray(simplifier.triangles.ravel(), len(vertices)), error))
+
+    return lods
+
+def selectLOD(lods, distance, projection, screen_height=768, pixel_error=1.0):
+
+    # Picks the coarsest level whose error, seen from distance with the
+    # projection matrix of glm_perspective, stays under pixel_error pixels
+    # on a screen_height pixels high viewport.
+    pixelsPerUnit = projection[1][1]*screen_height/(2.*max(distance,1e-6))
+    level = 0
+    for i,(indices,error) in enumerate(lods):
+        if error*pixelsPerUnit<=pixel_error: level = i
+    return level
@@ -0,0 +1,175 @@
+import os
+import numpy as np
+
+# Mipmaps built on the CPU, instead of glGenerateMipmap whose filter (and
+# cost, on software GL) depends on the driver :
+#
+#   levels = buildMipmaps(image, filter="lanczos", gamma=True)
+#
+# image is a (height,width,channels) uint8 array, any number of channels.
+# Each level is filtered from the previous one, in float, down to 1x1, with
+# the sizes OpenGL expects : halving rounds down.
+#
+# - "box" averages the pixels each new pixel covers : 2x2, or 3 with
+#   partial weights across odd sizes.
+# - "kaiser" and "lanczos" are windowed sincs 3 pixels wide, sharper than
+#   the box, which blurs every level a bit more.
+# gamma=True filters the color channels in linear light, so that the
+# levels of sRGB images don't get darker than they should. The 4th
+# channel, alpha, is always filtered as it is.
+#
+# cachedMipmaps saves the levels of a file next to it, see below.
+
+filters = ("box", "kaiser", "lanczos")
+
+# Half width of the windowed sinc filters, in pixels of the new level
+_support = 3.
+_kaiserAlpha = 4.
+
+def mipmapSizes(width, height):
+    # (width, height) of every level, the full image first
+    sizes = [(width,height)]
+    while width>1 or height>1:
+        width,height = max(width//2,1),max(height//2,1)
+        sizes.append((width,height))
+    return sizes
+
+def _srgbToLinear(image):
+    table = np.arange(256, dtype=np.float64)/255.
+    table = np.where(table<=0.04045, table/12.92, ((table+0.055)/1.055)**2.4).astype(np.float32)
+    return table[image]
+
+def _linearToSRGB(image):
+    image = np.clip(image, 0., 1.)
+    return np.where(image<=0.0031308, image*12.92, 1.055*image**(1./2.4)-0.055)
+
+def _halveBox(image, axis):
+    # An odd size 2m+1 becomes m pixels, each one the average of the 3
+    # source pixels it covers, the side ones partly
+    n = image.shape[axis]
+    image = np.moveaxis(image, axis, 0)
+    if n%2==0:
+        out = 0.5*(image[0::2]+image[1::2])
+    else:
+        m = n//2
+        i = np.arange(m, dtype=np.float32).reshape((m,)+(1,)*(image.ndim-1))
+        out = ((m-i)*image[0:-1:2]+m*image[1::2]+(i+1)*image[2::2])/n
+    return np.moveaxis(out, 0, axis)
+
+def _kernel(filter, x):
+    # Windowed sinc, x in pixels of the new level
+    inside = np.abs(x)<_support
+    if filter=="lanczos":
+        window = np.sinc(x/_support)
+    else:
+        t = np.sqrt(np.clip(1.-(x/_support)**2, 0., 1.))
+        window = np.i0(_kaiserAlpha*t)/np.i0(_kaiserAlpha)
+    return np.where(inside, np.sinc(x)*window, 0.)
+
+def _halveSinc(image, axis, filter):
+    # Each new pixel is a weighted sum of the source pixels under the
+    # kernel around its center, the edge pixels repeating past the borders.
+    # One pass over the image per tap of the kernel.
+    n = image.shape[axis]
+    m = n//2
+    scale = n/m
+    centers = (np.arange(m)+0.5)*scale-0.5
+    first = np.floor(centers-_support*scale).astype(np.int64)+1
+    taps = int(np.ceil(2*_support*scale))
+    positions = first[:,None]+np.arange(taps)
+    weights = _kernel(filter, (positions-centers[:,None])/scale)
+    weights = (weights/weights.sum(axis=1, keepdims=True)).astype(np.float32)
+    positions = np.clip(positions, 0, n-1)
+
+    image = np.moveaxis(image, axis, 0)
+    shape = (m,)+(1,)*(image.ndim-1)
+    out = np.zeros((m,)+image.shape[1:], dtype=np.float32)
+    for k in range(taps):
+        out += weights[:,k].reshape(shape)*image[positions[:,k]]
+    return np.moveaxis(out, 0, axis)
+
+def _halve(image, axis, filter):
+    if image.shape[axis]==1: return image
+    if filter=="box": return _halveBox(image, axis)
+    return _halveSinc(image, axis, filter)
+
+def buildMipmaps(image, filter="box", gamma=False):
+
+    # Returns the levels of image, the full image first, as uint8 arrays
+    # with its number of channels
+    if filter not in filters:
+        raise RuntimeError("Unknown mipmap filter {:}, expected one of {:}".format(filter, filters))
+    image = np.asarray(image, dtype=np.uint8)
+    if image.ndim==2: image = image[:,:,None]
+    colors = min(image.shape[2],3) if gamma else 0
+
+    levels = [image]
+    current = image.astype(np.float32)/255.
+    if colors: current[...,:colors] = _srgbToLinear(image[...,:colors])
+    while current.shape[0]>1 or current.shape[1]>1:
+        # The sinc filters ring : clip, so that the next levels don't
+        # amplify it
+        current = np.clip(_halve(_halve(current, 0, filter), 1, filter), 0., 1.)
+        level = current.copy()
+        if colors: level[...,:colors] = _linearToSRGB(level[...,:colors])
+        levels.append(np.rint(level*255.).astype(np.uint8))
+    return levels
+
+# Cache of the levels of image files.
+#
+# The levels after the first one are saved, one after the other, in a .npy
+# file next to the source : "uvtemplate.bmp" gets
+# "uvtemplate.bmp.lanczos.srgb.mipmaps.npy" for instance. It is used as long
+# as it is newer than the source, and memory-mapped back, so it is not even
+# read before the levels are uploaded. When the directory of the source is
+# not writable, the levels are just built every time.
+
+def cachePath(path, filter="box", gamma=False):
+    return "{:}.{:}{:}.mipmaps.npy".format(path, filter, ".srgb" if gamma else "")
+
+def _splitLevels(data, sizes, channels):
+    levels,offset = [],0
+    for width,height in sizes:
+        size = width*height*channels
+        levels.append(data[offset:offset+size].reshape(height,width,channels))
+        offset += size
+    return levels
+
+def cachedMipmaps(path, image, filter="box", gamma=False):
+
+    # buildMipmaps(image, filter, gamma) for the image of the file path,
+    # from the cache when possible. The first level is image itself.
+    image = np.asarray(image)
+    height,width,channels = image.shape
+    sizes = mipmapSizes(width, height)[1:]
+    expected = sum(w*h for w,h in sizes)*channels
+
+    cache = cachePath(path, filter, gamma)
+    try:
+        if os.path.getmtime(cache)>=os.path.getmtime(path):
+            data = np.load(cache, mmap_mode='r')
+            if data.dtype==np.uint8 and data.shape==(expected,):
+                return [image]+_splitLevels(data, sizes, channels)
+    except (OSError,ValueError): pass
+
+    print("Building mipmaps of {:} ({:}{:})".format(path, filter, ", gamma correct" if gamma else ""))
+    levels = buildMipmaps(image, filter, gamma)
+    data = np.concatenate([level.ravel() for level in levels[1:]]) if len(levels)>1 else np.zeros(0, dtype=np.uint8)
+
+    # Write then rename, so that an interrupted save never leaves a half
+    # written cache behind
+    tmpPath = cache+".tmp{:}".format(os.getpid())
+    try:
+        np.save(tmpPath, data)
+        os.replace(tmpPath+".npy", cache)
+    except OSError:
+        try: os.remove(tmpPath+".npy")
+        except OSError: pass
+    return levels
+
+def invalidate(path):
+    # Forget the cached mipmaps of the file path, for every filter
+    for filter in filters:
+        for gamma in (False,True):
+            try: os.remove(cachePath(path, filter, gamma))
+            except OSError: pass
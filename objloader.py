@@ -1,59 +1,464 @@
-import numpy as np
-
-# Very, VERY simple OBJ loader.
-# Here is a short list of features a real function would provide : 
-# - Binary files. Reading a model should be just a few memcpy's away, not parsing a file at runtime. In short : OBJ is not very great.
-# - Animations & bones (includes bones weights)
-# - Multiple UVs
-# - All attributes should be optional, not "forced"
-# - More stable. Change a line in the OBJ file and it crashes.
-# - More secure. Change another line and you can inject code.
-# - Loading from memory, stream, etc
-
-def loadOBJ(path, invert_v=False):
-    
-    print("Loading OBJ file {:}...".format(path))
-
-    try: f = open(path,'r')
-    except:
-        raise RuntimeError("Impossible to open the file! Are you in the right path?"
-        " See Tutorial 1 for details")
-    
-    temp_vertices,temp_uvs,temp_normals,indices = [],[],[],[]
-
-    for l in f:
-
-	# read the first word of the line
-        ls = l.split()
-        if len(ls)==0 or l[0]=='#': continue
-        lineHeader = ls[0] 
-		
-	if lineHeader=="v":
-            temp_vertices.append([float(i) for i in ls[1:4]])
-	elif lineHeader=="vt":
-            temp_uvs.append([float(i) for i in ls[1:3]])
-            # Invert V coordinate since we will only use DDS texture, which are inverted. 
-            if invert_v: temp_uvs[-1][1] *= -1.
-	elif lineHeader=="vn":
-            temp_normals.append([float(i) for i in ls[1:4]])
-	elif lineHeader=="f":
-            ll = [[int(i) for i in ll.split('/')] for ll in ls[1:]]
-            for ll in ls[1:]:
-                indices.append([int(i) for i in ll.split('/')])
-    
-    out_vertices,out_uvs,out_normals = [],[],[]
-
-    # For each vertex of each triangle
-    for i in indices:
-	# Get the indices of its attributes
-	# Get the attributes thanks to the index
-	# Put the attributes in buffers
-	out_vertices.append( temp_vertices[ i[0]-1 ] )
-	out_uvs     .append( temp_uvs[ i[1]-1 ] )
-	out_normals .append( temp_normals[ i[2]-1 ] )
-	
-    return (
-            np.array(out_vertices,dtype=np.float32),
-            np.array(out_uvs,dtype=np.float32),
-            np.array(out_normals,dtype=np.float32)
-            )
+import numpy as np
+import mmap
+import multiprocessing
+import os
+import re
+from multiprocessing import resource_tracker,shared_memory
+from vboindexer import indexArray,uniqueRows,uniqueKeys,interleave
+
+# Very, VERY simple OBJ loader.
+# Here is a short list of features a real function would provide :
+# - Binary files. Reading a model should be just a few memcpy's away, not parsing a file at runtime. In short : OBJ is not very great.
+# - Animations & bones (includes bones weights)
+# - Multiple UVs
+# - All attributes should be optional, not "forced"
+# - More stable. Change a line in the OBJ file and it crashes.
+# - More secure. Change another line and you can inject code.
+
+# Regular expressions for the slow path : records with extra components
+# (vertex colors, 3D texture coordinates...) are read field by field.
+_fieldsRE = {
+        2 : re.compile(rb'^[ \t]*(\S+)[ \t]+(\S+)', re.M),
+        3 : re.compile(rb'^[ \t]*(\S+)[ \t]+(\S+)[ \t]+(\S+)', re.M),
+        }
+
+def _gatherLines(buf, starts, ends, skip):
+    # Copy the selected lines (with their line feeds) into one contiguous
+    # buffer, blanking out their first "skip" characters (the record type)
+    # and their trailing comments
+    lengths = ends-starts
+    total = lengths.sum()
+    offsets = np.cumsum(lengths)-lengths
+    # Mask of the bytes of the lines, one byte per byte of buf : buf is a
+    # run of gaps (maybe empty) each one followed by a selected line
+    bounds = np.empty(2*len(starts)+2, dtype=np.int64)
+    bounds[0],bounds[-1] = 0,len(buf)
+    bounds[1:-1:2],bounds[2:-1:2] = starts,ends
+    selected = np.zeros(2*len(starts)+1, dtype=np.bool_)
+    selected[1::2] = True
+    chunk = buf[np.repeat(selected, np.diff(bounds))]
+    for i in range(skip): chunk[offsets+i] = 32
+    hashes = chunk==35
+    if hashes.any():
+        # Blank from each '#' to the end of its line : the last '#' seen
+        # comes after the last line feed seen
+        positions = np.arange(total)
+        lastHash = np.maximum.accumulate(np.where(hashes, positions, -1))
+        lastNewline = np.maximum.accumulate(np.where(chunk==10, positions, -1))
+        chunk[lastHash>lastNewline] = 32
+    return chunk
+
+def _parseFloats(buf, starts, ends, skip, ncols):
+    if len(starts)==0: return np.zeros((0,ncols),dtype=np.float32)
+    chunk = _gatherLines(buf, starts, ends, skip).tobytes()
+    # np.fromstring reads the numbers without making a Python object of
+    # each, unlike bytes.split, but raises on anything else
+    try:
+        values = np.fromstring(chunk, dtype=np.float32, sep=' ')
+        if len(values)==ncols*len(starts): return values.reshape(-1,ncols)
+    except ValueError: pass
+    # Not exactly ncols numbers per line : keep the first ncols of each
+    records = _fieldsRE[ncols].findall(chunk)
+    if len(records)!=len(starts):
+        raise RuntimeError("Expected at least {:} numbers per record".format(ncols))
+    try: return np.array(records, dtype=np.float32)
+    except ValueError:
+        raise RuntimeError("Expected at least {:} numbers per record".format(ncols))
+
+def _parseFaces(buf, starts, ends):
+    # Returns the (n,3) table of face corners, and when some indices are
+    # relative the number (in 0..len(starts)) of the face line of every corner
+    if len(starts)==0: return np.zeros((0,3),dtype=np.int64),None
+    # Each face corner is "v/vt/vn" : turn the slashes into spaces and
+    # read every face as one long integer list
+    chunk = _gatherLines(buf, starts, ends, 1)
+    chunk[chunk==47] = 32
+    try: values = np.fromstring(chunk.tobytes(), dtype=np.int64, sep=' ')
+    except ValueError: values = None
+    if values is None or len(values)%3!=0:
+        raise RuntimeError("Faces must have v/vt/vn indices on every corner")
+    faces = values.reshape(-1,3)
+    if len(faces)==0 or faces.min()>0: return faces,None
+
+    # Find the line of every number : numbers begin where a non blank
+    # character follows a blank one, and every corner has 3 numbers
+    blank = (chunk==32)|(chunk==9)|(chunk==10)|(chunk==13)
+    numbers = np.flatnonzero(~blank[1:] & blank[:-1])+1
+    offsets = np.cumsum(ends-starts)-(ends-starts)
+    return faces,np.searchsorted(offsets, numbers[::3], 'right')-1
+
+def _parseRecords(data):
+    # Returns the vertex, uv and normal tables and the (n,3) table of
+    # 1-based v/vt/vn face indices found in the given bytes.
+    # When some indices are relative, also returns the number of v, vt and vn
+    # records found before the face line of each corner, None otherwise.
+    # The lines are sorted into buckets by their first two characters,
+    # then every bucket is converted in bulk.
+    buf = np.frombuffer(data, dtype=np.uint8)
+    newlines = np.flatnonzero(buf==10)
+    starts = np.concatenate(([0], newlines+1))
+    ends = np.concatenate((newlines+1, [len(buf)]))
+
+    # First two characters of each line, padded for empty last lines.
+    # Indented lines start at their first non blank character.
+    padded = np.concatenate((buf, np.array([10,10], dtype=np.uint8)))
+    indented = np.flatnonzero((padded[starts]==32)|(padded[starts]==9))
+    while len(indented):
+        starts[indented] += 1
+        c = padded[starts[indented]]
+        indented = indented[(c==32)|(c==9)]
+    c0,c1 = padded[starts],padded[starts+1]
+    blank = (c1==32)|(c1==9)
+
+    kinds = (c0==118)&blank, (c0==118)&(c1==116), (c0==118)&(c1==110)
+    faceLines = (c0==102)&blank
+    faces,lines = _parseFaces(buf, starts[faceLines], ends[faceLines])
+
+    before = None
+    if lines is not None:
+        faceStarts = starts[faceLines][lines]
+        before = np.stack([np.searchsorted(starts[k], faceStarts) for k in kinds], axis=1)
+
+    return (
+            _parseFloats(buf, starts[kinds[0]], ends[kinds[0]], 1, 3),
+            _parseFloats(buf, starts[kinds[1]], ends[kinds[1]], 2, 2),
+            _parseFloats(buf, starts[kinds[2]], ends[kinds[2]], 2, 3),
+            faces,
+            before
+            )
+
+def _resolveRelative(faces, before, base):
+    # OBJ indices can be relative : -1 is the last record read before the
+    # face. Make them absolute, base being the number of v, vt and vn records
+    # read before the parsed bytes.
+    if before is None: return faces
+    return np.where(faces<0, faces+before+np.asarray(base)+1, faces)
+
+class _Table:
+    # Growable (n,ncols) array. Capacity doubles, so appending parts one
+    # after the other costs a linear number of copies in total.
+    def __init__(self, ncols, dtype):
+        self.buffer = np.zeros((1024,ncols),dtype=dtype)
+        self.size = 0
+
+    def append(self, rows):
+        if self.size+len(rows)>len(self.buffer):
+            grown = np.zeros((max(2*len(self.buffer),self.size+len(rows)),self.buffer.shape[1]),
+                    dtype=self.buffer.dtype)
+            grown[:self.size] = self.buffer[:self.size]
+            self.buffer = grown
+        self.buffer[self.size:self.size+len(rows)] = rows
+        self.size += len(rows)
+
+    def data(self):
+        return self.buffer[:self.size]
+
+def _expand(vertices, uvs, normals, faces):
+    # For each vertex of each triangle, get the attributes thanks to its
+    # indices. Fancy indexing does the whole lookup at once.
+    indices = faces - 1
+    return (
+            vertices[ indices[:,0] ],
+            uvs[ indices[:,1] ],
+            normals[ indices[:,2] ]
+            )
+
+def _isPath(source):
+    return isinstance(source, (str, os.PathLike))
+
+def _sourceName(source):
+    if _isPath(source): return source
+    if hasattr(source, 'name'): return source.name
+    return "from memory"
+
+def _fileChunks(f, chunk_size):
+    # Read a chunk and cut it after its last line feed. The partial
+    # line left over goes in front of the next chunk.
+    rest = b''
+    while True:
+        block = f.read(chunk_size)
+        if isinstance(block, str): block = block.encode()
+        if not block: break
+        data = rest+block
+        cut = data.rfind(b'\n')+1
+        yield memoryview(data)[:cut]
+        rest = data[cut:]
+    if rest: yield rest
+
+def _lastLineFeed(view):
+    # Position just after the last line feed of the buffer, 0 if there is none
+    newlines = np.flatnonzero(np.frombuffer(view, dtype=np.uint8)==10)
+    return newlines[-1]+1 if len(newlines) else 0
+
+def _bufferChunks(view, chunk_size):
+    # Slice the buffer in pieces ending on line feeds : no copy is made
+    start = 0
+    while start<len(view):
+        end = min(start+chunk_size, len(view))
+        cut = _lastLineFeed(view[start:end]) if end<len(view) else end-start
+        while cut==0:
+            # A line longer than chunk_size, look further
+            end = min(end+chunk_size, len(view))
+            cut = _lastLineFeed(view[start:end]) if end<len(view) else end-start
+        yield view[start:start+cut]
+        start += cut
+
+def _chunks(source, chunk_size):
+    # Yields the content of source by pieces ending on line feeds. source is
+    # a file path, a binary file object, or any object exposing its bytes
+    # through the buffer protocol (bytes, bytearray, memoryview, mmap...),
+    # which is parsed in place.
+    if _isPath(source):
+        try: f = open(source,'rb')
+        except:
+            raise RuntimeError("Impossible to open the file! Are you in the right path?"
+            " See Tutorial 1 for details")
+        try: yield from _fileChunks(f, chunk_size)
+        finally: f.close()
+    elif hasattr(source, 'read') and not isinstance(source, mmap.mmap):
+        yield from _fileChunks(source, chunk_size)
+    else:
+        with memoryview(source) as view:
+            with view.cast('B') as data:
+                yield from _bufferChunks(data, chunk_size)
+
+def _iterTables(source, invert_v, chunk_size):
+
+    # Parses source chunk by chunk. After each chunk, yields the v/vt/vn
+    # tables read so far and the faces of the chunk, with absolute indices.
+    vertices,uvs,normals = _Table(3,np.float32),_Table(2,np.float32),_Table(3,np.float32)
+
+    for data in _chunks(source, chunk_size):
+
+        temp_vertices,temp_uvs,temp_normals,faces,before = _parseRecords(data)
+        faces = _resolveRelative(faces, before, (vertices.size,uvs.size,normals.size))
+        del data
+
+        # Invert V coordinate since we will only use DDS texture, which are inverted.
+        if invert_v: temp_uvs[:,1] *= -1.
+
+        vertices.append(temp_vertices)
+        uvs.append(temp_uvs)
+        normals.append(temp_normals)
+        yield vertices,uvs,normals,faces
+
+def iterOBJ(source, batch_size=65536, invert_v=False, chunk_size=1<<23):
+
+    # Reads the OBJ data chunk_size bytes at a time and yields the vertices,
+    # uvs and normals of batch_size triangles at a time, in file order.
+    # Only the v/vt/vn tables are kept in memory : the faces are de-indexed
+    # and handed over batch by batch, so a whole mesh never has to be resident.
+    # source is a path, a binary file object, bytes, a memoryview or a mmap.
+
+    pending,npending = [],0
+    batch = 3*batch_size
+    vertices = None
+
+    for vertices,uvs,normals,faces in _iterTables(source, invert_v, chunk_size):
+
+        pending.append(faces)
+        npending += len(faces)
+
+        # Hand over the full batches
+        while npending>=batch:
+            faces = np.concatenate(pending)
+            yield _expand(vertices.data(), uvs.data(), normals.data(), faces[:batch])
+            pending = [faces[batch:]]
+            npending = len(pending[0])
+
+    # and at the end of the file what remains
+    if npending>0:
+        yield _expand(vertices.data(), uvs.data(), normals.data(), np.concatenate(pending))
+
+def loadIndexedOBJ(source, invert_v=False, interleaved=False):
+
+    # Same result as indexVBO(*loadOBJ(source)), straight from the v/vt/vn
+    # indices of the faces : the de-indexed arrays are never built.
+    # interleaved=True returns the indices and one interleaved array.
+    print("Loading indexed OBJ file {:}...".format(_sourceName(source)))
+
+    # The face indices are kept as int32 : 12 bytes per corner, against
+    # 32 for the de-indexed vertices
+    vertices,uvs,normals,faces = _Table(3,np.float32),_Table(2,np.float32),_Table(3,np.float32),[]
+    for vertices,uvs,normals,chunkFaces in _iterTables(source, invert_v, 1<<21):
+        if len(chunkFaces) and (chunkFaces.min()<1 or chunkFaces.max()>np.iinfo(np.int32).max):
+            raise RuntimeError("Face indices out of the v/vt/vn records")
+        faces.append(chunkFaces.astype(np.int32))
+    faces = np.concatenate(faces) if faces else np.zeros((0,3),dtype=np.int32)
+    faces -= 1
+    tables = vertices.data(),uvs.data(),normals.data()
+
+    # Number the distinct values of each table first : two corners get the
+    # same vertex, as in indexVBO, when their three numbers are the same.
+    # The tables are much smaller than the faces.
+    ids,counts = [],[]
+    for table in tables:
+        first,inverse = uniqueRows(table)
+        ids.append(inverse)
+        counts.append(len(first))
+
+    # One int64 key per corner, from the numbers of its 3 values. Their
+    # first occurrences give the vertices, in the order of indexVBO.
+    if counts[0]*counts[1]*counts[2]<2**63:
+        key = ids[0][faces[:,0]]
+        key *= counts[1]
+        key += ids[1][faces[:,1]]
+        key *= counts[2]
+        key += ids[2][faces[:,2]]
+        first,inverse = uniqueKeys(key)
+        del key
+    else:
+        first,inverse = uniqueRows(np.stack([i[faces[:,k]] for k,i in enumerate(ids)], axis=1))
+
+    corners = faces[first]
+    out = [table[corners[:,k]] for k,table in enumerate(tables)]
+    indices = indexArray(inverse, len(first))
+
+    if interleaved: return indices,interleave(*out)
+    return (indices,)+tuple(out)
+
+def _byteRanges(path, n):
+    # Split the file in about n ranges of bytes, each one ending on a line feed
+    size = os.path.getsize(path)
+    bounds = [0]
+    f = open(path,'rb')
+    for i in range(1,n):
+        # Go to the first line beginning at or after the ideal bound
+        f.seek(max(size*i//n-1, bounds[-1]))
+        f.readline()
+        if f.tell()>bounds[-1] and f.tell()<size: bounds.append(f.tell())
+    f.close()
+    bounds.append(size)
+    return list(zip(bounds[:-1],bounds[1:]))
+
+def _toSharedMemory(arrays):
+    # Pack the arrays in one shared memory block. Returns the block name and
+    # the (offset,shape,dtype) of each array in it.
+    layout,offset = [],0
+    for a in arrays:
+        layout.append((offset,a.shape,a.dtype.str))
+        offset += (a.nbytes+63)//64*64
+    shm = shared_memory.SharedMemory(create=True, size=max(offset,1))
+    for a,(offset,shape,dtype) in zip(arrays,layout):
+        np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)[...] = a
+    shm.close()
+    return shm.name,layout
+
+def _fromSharedMemory(shm, layout):
+    return [np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+            for offset,shape,dtype in layout]
+
+def _parseRange(args):
+    # Worker of the parallel loader : parse a range of bytes of the file
+    # straight from a memory map and return the tables in shared memory
+    path,start,end = args
+    f = open(path,'rb')
+    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    f.close()
+    view = memoryview(mm)[start:end]
+    try: records = _parseRecords(view)
+    finally:
+        # After an error, arrays of the traceback may still use the mapping :
+        # it is then closed once they are freed
+        try:
+            view.release()
+            mm.close()
+        except BufferError: pass
+    temp_vertices,temp_uvs,temp_normals,faces,before = records
+    if before is None: before = np.zeros((0,3),dtype=np.int64)
+    return _toSharedMemory([temp_vertices,temp_uvs,temp_normals,faces,before])
+
+def _attachBlocks(pending, blocks):
+    # Attach the shared memory blocks of the ranges parsed successfully,
+    # by name, which are not in blocks yet
+    for result in pending:
+        if result.ready() and result.successful():
+            name = result.get()[0]
+            if name not in blocks: blocks[name] = shared_memory.SharedMemory(name=name)
+
+def _loadOBJParallel(path, invert_v, processes):
+
+    # Several ranges per process, so that they stay busy when some ranges
+    # happen to hold more faces than others
+    if processes is None: processes = os.cpu_count()
+    ranges = _byteRanges(path, 4*processes)
+
+    # Start the resource tracker now, so that the workers share ours and the
+    # blocks they create are forgotten once unlinked here
+    if os.name=='posix': resource_tracker.ensure_running()
+
+    pool = multiprocessing.Pool(processes)
+    pending,blocks = [],{}
+    try:
+        try:
+            pending = [pool.apply_async(_parseRange, [(path,start,end)]) for start,end in ranges]
+            # Wait for every range, even after one failed, so that all the
+            # blocks the workers create are known and unlinked below
+            for result in pending: result.wait()
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+        _attachBlocks(pending, blocks)
+        # Raises the error of the first range which failed
+        results = [result.get() for result in pending]
+        parts = [_fromSharedMemory(blocks[name],layout) for name,layout in results]
+
+        # Relative indices of a range were resolved as if the file began with
+        # it : shift them by the number of records of the previous ranges.
+        counts = np.array([[len(p[0]),len(p[1]),len(p[2])] for p in parts])
+        bases = np.cumsum(counts,axis=0)-counts
+        faces = np.concatenate([
+            _resolveRelative(p[3], p[4] if len(p[4]) else None, base)
+            for p,base in zip(parts,bases)])
+
+        vertices,uvs,normals = [np.concatenate([p[k] for p in parts]) for k in range(3)]
+        del parts
+    finally:
+        _attachBlocks(pending, blocks)
+        for shm in blocks.values():
+            # Arrays of the block may still be alive when an error is on
+            # its way out : the block is unlinked all the same
+            try: shm.close()
+            except BufferError: pass
+            shm.unlink()
+
+    # Invert V coordinate since we will only use DDS texture, which are inverted.
+    if invert_v: uvs[:,1] *= -1.
+
+    return _expand(vertices, uvs, normals, faces)
+
+def loadOBJ(source, invert_v=False, processes=1, interleaved=False):
+
+    # source is a path, a binary file object, bytes, a memoryview or a mmap.
+    # interleaved=True returns a single array of interleaved vertices.
+    arrays = _loadOBJ(source, invert_v, processes)
+    if interleaved: return interleave(*arrays)
+    return arrays
+
+def _loadOBJ(source, invert_v, processes):
+
+    print("Loading OBJ file {:}...".format(_sourceName(source)))
+
+    # Parse files across several processes ; processes=None uses every core.
+    # Data already in memory is parsed here.
+    if processes!=1 and _isPath(source):
+        path = source
+        if not os.path.isfile(path):
+            raise RuntimeError("Impossible to open the file! Are you in the right path?"
+            " See Tutorial 1 for details")
+        return _loadOBJParallel(path, invert_v, processes)
+
+    # Collect the batches of the streaming reader
+    batches = list(iterOBJ(source, batch_size=1<<20, invert_v=invert_v))
+    if len(batches)==0:
+        return (
+                np.zeros((0,3),dtype=np.float32),
+                np.zeros((0,2),dtype=np.float32),
+                np.zeros((0,3),dtype=np.float32)
+                )
+    if len(batches)==1: return batches[0]
+    return tuple(np.concatenate(arrays) for arrays in zip(*batches))
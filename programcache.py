@@ -0,0 +1,102 @@
+import hashlib
+import os
+import ctypes
+import numpy as np
+from OpenGL.GL import *
+from OpenGL.raw.GL.VERSION.GL_4_1 import glGetProgramBinary as _glGetProgramBinary
+from OpenGL.raw.GL.VERSION.GL_4_1 import glProgramBinary as _glProgramBinary
+
+# On-disk cache of linked shader programs.
+#
+# After a program is linked from its sources, the driver's binary of it
+# (glGetProgramBinary) is saved in a file named after a hash of the
+# sources and of the GL vendor, renderer and version. The next runs give
+# it back to the driver with glProgramBinary, without compiling anything.
+# The driver may still reject a binary (after an update it did not report
+# in its version string...) : the program is then compiled from source and
+# the cache entry replaced.
+
+cacheDir = os.environ.get("PROGRAM_CACHE_DIR", ".programcache")
+
+def setCacheDir(path):
+    global cacheDir
+    cacheDir = path
+
+def supported():
+    # Whether the driver can give program binaries back at all
+    try: return glGetIntegerv(GL_NUM_PROGRAM_BINARY_FORMATS)>0
+    except GLError: return False
+
+def programKey(*sources):
+    h = hashlib.sha1()
+    for s in (GL_VENDOR, GL_RENDERER, GL_VERSION):
+        h.update(glGetString(s) or b'')
+        h.update(b'\0')
+    for source in sources:
+        h.update(source.encode())
+        h.update(b'\0')
+    return h.hexdigest()
+
+def _binaryPath(key):
+    return os.path.join(cacheDir, key+".bin")
+
+def loadProgram(key):
+    # A new linked program from the binary cached under key, or None if
+    # there is none or the driver rejects it
+    try: data = np.fromfile(_binaryPath(key), dtype=np.uint8)
+    except OSError: return None
+    if len(data)<4: return None
+
+    # 4 bytes of binary format, then the binary
+    binaryFormat = int(data[:4].view(np.uint32)[0])
+    binary = np.ascontiguousarray(data[4:])
+
+    # PyOpenGL checks the errors of the raw calls too : a format the driver
+    # doesn't know raises GLError (GL_INVALID_ENUM) instead of just failing
+    # the link
+    program = glCreateProgram()
+    try:
+        _glProgramBinary(program, binaryFormat, ctypes.c_void_p(binary.ctypes.data), len(binary))
+        linked = glGetProgramiv(program, GL_LINK_STATUS)
+    except GLError:
+        linked = False
+    if not linked:
+        glDeleteProgram(program)
+        invalidate(key)
+        return None
+    return program
+
+def saveProgram(key, program):
+    # Save the binary of a linked program, which must have been linked with
+    # GL_PROGRAM_BINARY_RETRIEVABLE_HINT set
+    written = np.zeros(1, dtype=np.int32)
+    binaryFormat = np.zeros(1, dtype=np.uint32)
+    try:
+        length = glGetProgramiv(program, GL_PROGRAM_BINARY_LENGTH)
+        if length>0:
+            data = np.zeros(4+length, dtype=np.uint8)
+            _glGetProgramBinary(program, length, written, binaryFormat, ctypes.c_void_p(data[4:].ctypes.data))
+    except GLError:
+        written[0] = 0
+    if written[0]<=0:
+        invalidate(key)
+        return False
+    data[:4] = binaryFormat.view(np.uint8)
+
+    # Write then rename, so that an interrupted save never leaves a half
+    # written binary behind
+    os.makedirs(cacheDir, exist_ok=True)
+    tmpPath = _binaryPath(key)+".tmp{:}".format(os.getpid())
+    data[:4+int(written[0])].tofile(tmpPath)
+    os.replace(tmpPath, _binaryPath(key))
+    return True
+
+def invalidate(key=None):
+    # Forget the binary cached under key, or the whole cache
+    if key is not None:
+        try: os.remove(_binaryPath(key))
+        except OSError: pass
+        return
+    if not os.path.isdir(cacheDir): return
+    for name in os.listdir(cacheDir):
+        if name.endswith(".bin"): os.remove(os.path.join(cacheDir, name))
@@ -0,0 +1,202 @@
+import numpy as np
+
+# Software decoder of the S3TC (DXT1, DXT3 and DXT5, aka BC1, BC2 and BC3)
+# compressed formats, for drivers without GL_EXT_texture_compression_s3tc
+# and to look at the pixels of .DDS files on the CPU :
+#
+#   rgba = decodeS3TC(b'DXT3', data, 512, 512) # (512,512,4) uint8
+#
+# Every 4x4 block of a level is decoded at once, with array operations on
+# all the blocks : there is no loop over the blocks or the pixels.
+
+# A color block : 2 RGB565 end points, then 2 bits per pixel, the first
+# pixel in the lowest bits, row by row
+_colorDtype = np.dtype([('color0', '<u2'), ('color1', '<u2'), ('indices', '<u4')])
+
+_blockDtypes = {
+    b'DXT1': np.dtype([('color', _colorDtype)]),
+    # 4 bits of alpha per pixel
+    b'DXT3': np.dtype([('alpha', '<u8'), ('color', _colorDtype)]),
+    # 2 alpha end points, then 3 bits per pixel
+    b'DXT5': np.dtype([('alpha0', 'u1'), ('alpha1', 'u1'), ('alphaIndices', 'u1', 6), ('color', _colorDtype)]),
+    }
+
+def _expand565(c):
+    # RGB565 to 8 bits per channel, replicating the high bits in the low ones
+    c = c.astype(np.int32)
+    r,g,b = c>>11&31, c>>5&63, c&31
+    return np.stack((r<<3|r>>2, g<<2|g>>4, b<<3|b>>2), axis=-1)
+
+def _pixelIndices(bits, width):
+    # The 16 fields of width bits packed in bits, first pixel lowest
+    shifts = np.arange(16, dtype=np.uint64)*np.uint64(width)
+    mask = np.uint64((1<<width)-1)
+    return (bits.astype(np.uint64)[...,None]>>shifts&mask).astype(np.intp)
+
+def _decodeColors(blocks, punchThrough):
+    # RGBA of the 16 pixels of every color block, (n,16,4) uint8. DXT1
+    # blocks with color0<=color1 have 3 colors and a transparent black,
+    # which DXT3 and DXT5 ignore (always 4 colors).
+    c0,c1 = blocks['color0'],blocks['color1']
+    p0,p1 = _expand565(c0),_expand565(c1)
+    palette = np.empty(c0.shape+(4,4), dtype=np.int32)
+    palette[...,0,:3] = p0
+    palette[...,1,:3] = p1
+    palette[...,2,:3] = (2*p0+p1)//3
+    palette[...,3,:3] = (p0+2*p1)//3
+    palette[...,:,3] = 255
+
+    if punchThrough:
+        three = (c0<=c1)[...,None]
+        palette[...,2,:3] = np.where(three, (p0+p1)//2, palette[...,2,:3])
+        palette[...,3,:] = np.where(three, 0, palette[...,3,:])
+
+    indices = _pixelIndices(blocks['indices'], 2)
+    return np.take_along_axis(palette, indices[...,None], axis=-2).astype(np.uint8)
+
+def _decodeAlphaDXT5(blocks):
+    # Alpha of the 16 pixels of every DXT5 block, (n,16) uint8
+    a0 = blocks['alpha0'].astype(np.int32)[...,None]
+    a1 = blocks['alpha1'].astype(np.int32)[...,None]
+    i = np.arange(1,7)
+    # a0>a1 : 6 values between the end points, else 4, then 0 and 255
+    eight = (a0*(7-i)+a1*i)//7
+    six = np.concatenate(((a0*(5-i[:4])+a1*i[:4])//5,
+            np.zeros_like(a0), np.full_like(a0,255)), axis=-1)
+    palette = np.concatenate((a0, a1, np.where(a0>a1, eight, six)), axis=-1)
+
+    # The 48 bits of indices, as a little endian integer
+    bytes6 = blocks['alphaIndices'].astype(np.uint64)
+    bits = (bytes6<<(np.arange(6, dtype=np.uint64)*np.uint64(8))).sum(axis=-1, dtype=np.uint64)
+    return np.take_along_axis(palette, _pixelIndices(bits, 3), axis=-1).astype(np.uint8)
+
+def decodeS3TC(fourCC, data, width, height):
+
+    # Decodes a level of width x height pixels of compressed data (bytes, or
+    # any buffer) in the fourCC format, b'DXT1', b'DXT3' or b'DXT5'.
+    # Returns its RGBA, (height,width,4) uint8, the rows in the order of the
+    # data. Levels smaller than a block are cropped from a whole block.
+    if fourCC not in _blockDtypes:
+        raise RuntimeError("Didn't understand format code: {:}".format(fourCC))
+    bx,by = max((width+3)//4,1),max((height+3)//4,1)
+    blocks = np.frombuffer(data, dtype=_blockDtypes[fourCC], count=bx*by)
+
+    rgba = _decodeColors(blocks['color'], punchThrough=fourCC==b'DXT1')
+    if fourCC==b'DXT3':
+        # 4 bits to 8 : 0xF becomes 0xFF
+        rgba[...,3] = _pixelIndices(blocks['alpha'], 4)*17
+    elif fourCC==b'DXT5':
+        rgba[...,3] = _decodeAlphaDXT5(blocks)
+
+    # (blocks, 4 rows, 4 columns) to the rows of the image
+    rgba = rgba.reshape(by, bx, 4, 4, 4).transpose(0, 2, 1, 3, 4).reshape(4*by, 4*bx, 4)
+    return np.ascontiguousarray(rgba[:height,:width])
+
+# Encoder
+
+def _blocks(rgba):
+    # (height,width,4) to (n,16,4) pixels of the 4x4 blocks, row by row.
+    # Levels which are not a multiple of 4 repeat their last row and column.
+    height,width = rgba.shape[:2]
+    bx,by = max((width+3)//4,1),max((height+3)//4,1)
+    rgba = np.pad(rgba, ((0,4*by-height),(0,4*bx-width),(0,0)), mode='edge')
+    return rgba.reshape(by, 4, bx, 4, 4).transpose(0, 2, 1, 3, 4).reshape(bx*by, 16, 4)
+
+def _packIndices(indices, width, dtype):
+    shifts = np.arange(16, dtype=np.uint64)*np.uint64(width)
+    return (indices.astype(np.uint64)<<shifts).sum(axis=-1, dtype=np.uint64).astype(dtype)
+
+def _quantize565(c):
+    c = np.clip(np.rint(c*[31./255.,63./255.,31./255.]), 0, [31,63,31]).astype(np.int32)
+    return (c[...,0]<<11|c[...,1]<<5|c[...,2]).astype(np.uint16)
+
+def _assign(pixels, c0, c1):
+    # Nearest of the 4 colors of the palette of c0 and c1, as the decoder
+    # builds it, for each pixel, and the squared error of the block
+    p0,p1 = _expand565(c0),_expand565(c1)
+    palette = np.stack((p0, p1, (2*p0+p1)//3, (p0+2*p1)//3), axis=1).astype(np.float64)
+    distances = ((pixels[:,:,None,:]-palette[:,None,:,:])**2).sum(axis=-1)
+    indices = distances.argmin(axis=-1)
+    return indices,np.take_along_axis(distances, indices[...,None], axis=-1).sum(axis=(1,2))
+
+def _fitColors(pixels, iterations=2):
+
+    # End points along the principal axis of the colors of every block,
+    # found by power iteration on their covariance, then refined by least
+    # squares on the indices they give
+    mean = pixels.mean(axis=1)
+    centered = pixels-mean[:,None]
+    covariance = np.einsum('nki,nkj->nij', centered, centered)
+    axis = pixels.max(axis=1)-pixels.min(axis=1)
+    for i in range(8):
+        axis = np.einsum('nij,nj->ni', covariance, axis)
+        axis /= np.maximum(np.abs(axis).max(axis=1),1e-12)[:,None]
+    t = np.einsum('nki,ni->nk', centered, axis)
+    c0 = _quantize565(mean+t.max(axis=1)[:,None]*axis)
+    c1 = _quantize565(mean+t.min(axis=1)[:,None]*axis)
+    indices,error = _assign(pixels, c0, c1)
+
+    # Weight of the first end point of each index
+    weights = np.array([1., 0., 2./3., 1./3.])
+    for i in range(iterations):
+        a = weights[indices]
+        b = 1.-a
+        aa,ab,bb = (a*a).sum(axis=1),(a*b).sum(axis=1),(b*b).sum(axis=1)
+        ax = np.einsum('nk,nki->ni', a, pixels)
+        bx = np.einsum('nk,nki->ni', b, pixels)
+        det = aa*bb-ab*ab
+        ok = np.abs(det)>1e-9
+        det = np.where(ok, det, 1.)[:,None]
+        n0 = _quantize565((bb[:,None]*ax-ab[:,None]*bx)/det)
+        n1 = _quantize565((aa[:,None]*bx-ab[:,None]*ax)/det)
+        newIndices,newError = _assign(pixels, n0, n1)
+        better = ok & (newError<error)
+        c0,c1 = np.where(better,n0,c0),np.where(better,n1,c1)
+        indices,error = np.where(better[:,None],newIndices,indices),np.where(better,newError,error)
+
+    # color0>color1 selects the 4 colors mode : swap the end points (and
+    # indices 0<->1, 2<->3) where needed. Single color blocks use index 0.
+    swap = c0<c1
+    c0,c1 = np.where(swap,c1,c0),np.where(swap,c0,c1)
+    indices = np.where(swap[:,None], indices^1, indices)
+    indices = np.where((c0==c1)[:,None], 0, indices)
+    return c0,c1,indices
+
+def _fitAlphaDXT5(alpha):
+    # The smallest and largest alpha as end points, in the 8 values mode
+    a0,a1 = alpha.max(axis=1),alpha.min(axis=1)
+    i = np.arange(1,7)
+    palette = np.concatenate((a0[:,None], a1[:,None],
+            (a0[:,None]*(7-i)+a1[:,None]*i)//7), axis=1)
+    indices = np.abs(alpha[:,:,None]-palette[:,None,:]).argmin(axis=-1)
+    indices = np.where((a0==a1)[:,None], 0, indices)
+    return a0,a1,indices
+
+def encodeS3TC(fourCC, rgba):
+
+    # Encodes a level, (height,width,3) or (height,width,4) uint8, in the
+    # fourCC format, the rows in the order of the array. DXT1 is opaque :
+    # use DXT3 or DXT5 to keep the alpha.
+    # Returns the compressed level, as decodeS3TC takes it.
+    if fourCC not in _blockDtypes:
+        raise RuntimeError("Didn't understand format code: {:}".format(fourCC))
+    rgba = np.asarray(rgba, dtype=np.uint8)
+    if rgba.shape[2]==3:
+        rgba = np.concatenate((rgba, np.full(rgba.shape[:2]+(1,), 255, dtype=np.uint8)), axis=2)
+    pixels = _blocks(rgba)
+
+    blocks = np.zeros(len(pixels), dtype=_blockDtypes[fourCC])
+    c0,c1,indices = _fitColors(pixels[...,:3].astype(np.float64))
+    blocks['color']['color0'],blocks['color']['color1'] = c0,c1
+    blocks['color']['indices'] = _packIndices(indices, 2, np.uint32)
+
+    alpha = pixels[...,3].astype(np.int32)
+    if fourCC==b'DXT3':
+        blocks['alpha'] = _packIndices((alpha*15+127)//255, 4, np.uint64)
+    elif fourCC==b'DXT5':
+        a0,a1,indices = _fitAlphaDXT5(alpha)
+        blocks['alpha0'],blocks['alpha1'] = a0,a1
+        bits = _packIndices(indices, 3, np.uint64)
+        blocks['alphaIndices'] = (bits[:,None]>>(np.arange(6, dtype=np.uint64)*np.uint64(8))&np.uint64(255)).astype(np.uint8)
+
+    return blocks.tobytes()
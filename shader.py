@@ -1,21 +1,152 @@
 from OpenGL.GL import *
+import ctypes
+import os
+import re
+import time
 import numpy as np
+import programcache
+
+# How to send each GL type of uniform : (numpy type, components,
+# function(location, count, values)). Arrays are sent whole, up to the size
+# of the uniform.
+def _matrix(function):
+    return lambda loc,count,values: function(loc, count, False, values)
+
+_uniformTypes = {
+    GL_FLOAT:      (np.float32, 1, glUniform1fv),
+    GL_FLOAT_VEC2: (np.float32, 2, glUniform2fv),
+    GL_FLOAT_VEC3: (np.float32, 3, glUniform3fv),
+    GL_FLOAT_VEC4: (np.float32, 4, glUniform4fv),
+    GL_INT:        (np.int32, 1, glUniform1iv),
+    GL_INT_VEC2:   (np.int32, 2, glUniform2iv),
+    GL_INT_VEC3:   (np.int32, 3, glUniform3iv),
+    GL_INT_VEC4:   (np.int32, 4, glUniform4iv),
+    GL_FLOAT_MAT2: (np.float32, 4, _matrix(glUniformMatrix2fv)),
+    GL_FLOAT_MAT3: (np.float32, 9, _matrix(glUniformMatrix3fv)),
+    GL_FLOAT_MAT4: (np.float32, 16, _matrix(glUniformMatrix4fv)),
+    }
+# Booleans and samplers are set as ints
+for glType in (GL_BOOL, GL_SAMPLER_1D, GL_SAMPLER_2D, GL_SAMPLER_3D, GL_SAMPLER_CUBE,
+        GL_SAMPLER_1D_SHADOW, GL_SAMPLER_2D_SHADOW, GL_SAMPLER_2D_ARRAY, GL_SAMPLER_2D_ARRAY_SHADOW,
+        GL_SAMPLER_CUBE_SHADOW, GL_SAMPLER_2D_RECT, GL_SAMPLER_BUFFER):
+    _uniformTypes[glType] = _uniformTypes[GL_INT]
+
+def _activeAttrib(program, index):
+    # glGetActiveAttrib through raw buffers : PyOpenGL's wrapper of it
+    # differs between versions
+    length,size,glType = GLsizei(),GLint(),GLenum()
+    name = (GLchar*256)()
+    glGetActiveAttrib(program, index, 256, length, size, glType, name)
+    return name.value.decode(),size.value,glType.value
+
+_includeRE = re.compile(r'^[ \t]*#[ \t]*include[ \t]+"([^"]+)"[ \t]*$', re.M)
+
+def _preprocess(path, files, stack=()):
+    # Source of the file path with its #include "file" lines replaced by
+    # the files, found relative to the including file. #line directives
+    # keep the line numbers of the compile errors right : the source
+    # string number of a file is its index in files.
+    path = os.path.normpath(path)
+    if path in stack:
+        raise RuntimeError("Recursive #include of {:}".format(path))
+    if path not in files: files.append(path)
+    number = files.index(path)
+    try: f = open(path)
+    except OSError:
+        raise RuntimeError("Impossible to open the shader {:}".format(path))
+    source = f.read()
+    f.close()
+
+    out,last,line = [],0,1
+    for m in _includeRE.finditer(source):
+        out.append(source[last:m.start()])
+        line += source.count('\n', last, m.start())
+        included = _preprocess(os.path.join(os.path.dirname(path), m.group(1)), files, stack+(path,))
+        out.append("#line 1 {:}\n{:}\n#line {:} {:}".format(
+            files.index(os.path.normpath(os.path.join(os.path.dirname(path), m.group(1)))),
+            included, line+1, number))
+        last = m.end()
+    out.append(source[last:])
+    return "".join(out)
+
+def _addDefines(source, defines, number):
+    # #define lines for the defines, after the #version line which must
+    # come first. number is the source string number of the source.
+    if not defines: return source
+    lines = "".join("#define {:} {:}\n".format(k, v) for k,v in sorted(defines.items()))
+    m = re.match(r'\s*#version[^\n]*\n', source)
+    if m is None: return lines+"#line 1 {:}\n".format(number)+source
+    version = m.group(0)
+    return version+lines+"#line {:} {:}\n".format(version.count('\n')+1, number)+source[m.end():]
+
+# Compiled variants, by their preprocessed sources
+_variants = {}
+
+def loadShader(vsUrl, fsUrl, defines=None):
+    # A compiled Shader for the sources with the preprocessor defines, a
+    # dict like {"PCF_SAMPLES": 4}. Variants are compiled once and shared.
+    shader = Shader(vsUrl, fsUrl, defines)
+    key = (shader.vsStr, shader.fsStr)
+    if key not in _variants:
+        shader.compile()
+        _variants[key] = shader
+    return _variants[key]
 
 class Shader:
-    def __init__(self, vsUrl, fsUrl):
+    def __init__(self, vsUrl, fsUrl, defines=None):
         self.vsUrl = vsUrl
         self.fsUrl = fsUrl
+        self.defines = dict(defines or {})
         self.vsStr, self.fsStr = self.getShaderStrings()
         self.vs = None
         self.fs = None
         self.program = None
+        self.uniforms = {}
+        self.attributes = {}
+        self.overlaps = {}
+        self.uniformValues = {}
+        self.uploads = 0
+        self.skippedUploads = 0
+        self.variants = {}
         
     def getShaderStrings(self):
-        vs = "\n".join(open(self.vsUrl).readlines())
-        fs = "\n".join(open(self.fsUrl).readlines())
+        # The sources with their #include resolved and the defines added.
+        # self.sourceFiles lists the files, by source string number of the
+        # compile errors.
+        self.sourceFiles = []
+        vs = _preprocess(self.vsUrl, self.sourceFiles)
+        vs = _addDefines(vs, self.defines, self.sourceFiles.index(os.path.normpath(self.vsUrl)))
+        fs = _preprocess(self.fsUrl, self.sourceFiles)
+        fs = _addDefines(fs, self.defines, self.sourceFiles.index(os.path.normpath(self.fsUrl)))
         return vs, fs
+
+    def variant(self, defines):
+        # The compiled variant of this shader with more defines, or other
+        # values for them. Later calls with the same defines are free.
+        key = tuple(sorted(defines.items()))
+        if key not in self.variants:
+            merged = dict(self.defines)
+            merged.update(defines)
+            self.variants[key] = loadShader(self.vsUrl, self.fsUrl, merged)
+        return self.variants[key]
     
-    def compile(self):
+    def compile(self, cache=True):
+        # Compiles and links the program, or loads it from the program
+        # binary cache (see programcache.py) when cache is True
+        start = time.perf_counter()
+        name = "{:} + {:}".format(self.vsUrl, self.fsUrl)
+        if self.defines:
+            name += " ("+", ".join("{:}={:}".format(k,v) for k,v in sorted(self.defines.items()))+")"
+        key = None
+        if cache and programcache.supported():
+            key = programcache.programKey(self.vsStr, self.fsStr)
+            self.program = programcache.loadProgram(key)
+            if self.program is not None:
+                print("Shader {:} : cache hit, loaded in {:.2f} ms".format(
+                    name, 1000.*(time.perf_counter()-start)))
+                self.introspect()
+                return
+
         self.vs = glCreateShader(GL_VERTEX_SHADER)
         glShaderSource(self.vs, self.vsStr)
         glCompileShader(self.vs)
@@ -33,10 +164,56 @@ class Shader:
         self.program = glCreateProgram()
         glAttachShader(self.program, self.vs)
         glAttachShader(self.program, self.fs)
+        if key is not None:
+            glProgramParameteri(self.program, GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL_TRUE)
         glLinkProgram(self.program)
         check = glGetProgramiv(self.program, GL_LINK_STATUS)
         if not(check):
             raise RuntimeError(glGetProgramInfoLog(self.program))
+
+        if key is not None:
+            programcache.saveProgram(key, self.program)
+            print("Shader {:} : cache miss, compiled in {:.2f} ms".format(
+                name, 1000.*(time.perf_counter()-start)))
+
+        self.introspect()
+
+    def introspect(self):
+        # Locations, GL types and array sizes of the active uniforms and
+        # attributes, queried once after linking. The members of a uniform
+        # array are also found by their own name ("taps[2]").
+        self.uniforms = {}
+        self.overlaps = {}
+        for i in range(glGetProgramiv(self.program, GL_ACTIVE_UNIFORMS)):
+            name,size,glType = glGetActiveUniform(self.program, i)
+            name = name.decode() if isinstance(name, bytes) else name
+            size,glType = int(size),int(glType)
+            loc = glGetUniformLocation(self.program, name)
+            if loc<0: continue # Member of a uniform block
+            if name.endswith("[0]"):
+                name = name[:-3]
+                members = ["{:}[{:}]".format(name,k) for k in range(size)]
+                for member in members:
+                    self.uniforms[member] = (glGetUniformLocation(self.program, member), glType, 1)
+                    self.overlaps[member] = [name]
+                self.overlaps[name] = members
+            self.uniforms[name] = (loc, glType, size)
+
+        self.attributes = {}
+        for i in range(glGetProgramiv(self.program, GL_ACTIVE_ATTRIBUTES)):
+            name,size,glType = _activeAttrib(self.program, i)
+            self.attributes[name] = (glGetAttribLocation(self.program, name), glType, size)
+
+        # A new program starts with all its uniforms at 0
+        self.invalidateUniforms()
+        self.uploads = 0
+        self.skippedUploads = 0
+
+    def invalidateUniforms(self):
+        # Forget the values sent so far, so that the next setUniform calls
+        # upload again. Call it if the uniforms of the program may have
+        # been changed behind our back, through glUniform* directly.
+        self.uniformValues = {}
     
     def enable(self):
         glUseProgram(self.program)
@@ -45,33 +222,52 @@ class Shader:
         glUseProgram(0)
 
     def getAttribLocation(self, aName):
-        return glGetAttribLocation(self.program, aName)
+        # -1 for attributes the program does not use
+        return self.attributes.get(aName, (-1,))[0]
         
     def getUniformLocation(self, uName):
-        return glGetUniformLocation(self.program, uName)
+        # -1 for uniforms the program does not use
+        return self.uniforms.get(uName, (-1,))[0]
     
-    def setUniform(self, uName, uType, data):
-        loc = self.getUniformLocation(uName)
-        if uType == "sampler2D" or uType == "sampler2DShadow":
-            glUniform1i(loc, data)
-        elif uType == "mat4":
-            glUniformMatrix4fv(loc, 1, False, data)
-        elif uType == "vec3":
-            glUniform3f(loc, *data)
-        elif uType == "float":
-            data = float(data)
-            glUniform1f(loc, data)
-        elif uType == "int":
-            data = int(data)
-            glUniform1i(loc, data)
-
-    def setAttribute(self, aName, aType, buff):
+    def setUniform(self, uName, *args, force=False):
+        # setUniform(name, data), the type coming from the program. The
+        # older setUniform(name, type, data) still works, the type string
+        # is ignored. Uniforms the program does not use are ignored too, as
+        # GL does for location -1.
+        # The last values sent are kept : sending the same bytes again is
+        # skipped, and counted in skippedUploads, unless force is True.
+        data = args[-1]
+        uniform = self.uniforms.get(uName)
+        if uniform is None: return
+        loc,glType,size = uniform
+        try: dtype,components,function = _uniformTypes[glType]
+        except KeyError:
+            raise RuntimeError("Can't set uniform {:} of GL type {:}".format(uName, glType))
+
+        values = np.asarray(data, dtype=dtype).ravel()
+        count = min(size, len(values)//components)
+        values = values[:count*components]
+
+        key = values.tobytes()
+        if not force and self.uniformValues.get(uName)==key:
+            self.skippedUploads += 1
+            return
+        function(loc, count, values)
+        self.uploads += 1
+        self.uniformValues[uName] = key
+        # An array and its members shadow each other
+        for other in self.overlaps.get(uName, ()): self.uniformValues.pop(other, None)
+
+    def setAttribute(self, aName, aType, buff, stride=0, offset=None,
+            normalized=False, glType=GL_FLOAT):
+        # stride and offset, in bytes, read one attribute of a buffer of
+        # interleaved vertices : stride=vertices.itemsize and
+        # offset=attributeOffset(vertices, "uv") for example
         loc = self.getAttribLocation(aName)
+        sizes = {"float": 1, "vec2": 2, "vec3": 3, "vec4": 4}
+        if aType not in sizes:
+            raise RuntimeError("Unknown attribute type {:}".format(aType))
         glEnableVertexAttribArray(loc)
         glBindBuffer(GL_ARRAY_BUFFER, buff)
-        if aType == "vec2":
-            glVertexAttribPointer(loc, 2, GL_FLOAT, False, 0, None)
-        elif aType == "vec3":
-            glVertexAttribPointer(loc, 3, GL_FLOAT, False, 0, None)
-        elif aType == "vec4":
-            glVertexAttribPointer(loc, 4, GL_FLOAT, False, 0, None)
+        if offset is not None: offset = ctypes.c_void_p(offset)
+        glVertexAttribPointer(loc, sizes[aType], glType, normalized, stride, offset)
@@ -0,0 +1,89 @@
+import multiprocessing
+import os
+import sys
+import numpy as np
+from s3tc import encodeS3TC,decodeS3TC
+from mipmaps import buildMipmaps
+from textures import readBMP,writeDDS
+
+# Offline compression of textures to DXT1 (BC1) or DXT5 (BC3) .DDS files,
+# which loadDDS uploads as they are : 4 or 8 bits per pixel instead of the
+# 24 of loadBMP, mipmaps included.
+#
+#   python texturecompressor.py uvtemplate.bmp uvtemplate_bc1.DDS DXT1
+#
+# or, from any (height,width,3) or (height,width,4) uint8 array :
+#
+#   compressTexture(rgba, "texture.DDS", fourCC=b'DXT5', processes=None)
+#
+# The rows of the arrays are in the order glTexImage2D takes them, bottom
+# row first, as readBMP(path, rgb=True) returns them. DDS files store the
+# top row first : the levels are flipped on their way to the file, so that
+# the meshes loaded with invert_v=True for the other .DDS files map them
+# the same way.
+
+def psnr(a, b):
+    # Peak signal to noise ratio of b against a, in dB
+    mse = np.mean((np.asarray(a,dtype=np.float64)-np.asarray(b,dtype=np.float64))**2)
+    return 10.*np.log10(255.**2/mse) if mse>0 else float('inf')
+
+def _encodeStrip(args):
+    # Worker of the pool : a strip of whole rows of blocks
+    fourCC,strip = args
+    return encodeS3TC(fourCC, strip)
+
+def _strips(image, count):
+    # Splits a level into at most count strips of whole rows of 4x4 blocks.
+    # Blocks rows are stored one after the other, so the compressed strips
+    # just follow each other too.
+    blockRows = (image.shape[0]+3)//4
+    bounds = np.linspace(0, blockRows, min(count,blockRows)+1).astype(int)*4
+    return [image[start:end] for start,end in zip(bounds[:-1],bounds[1:]) if start<end]
+
+def compressTexture(source, path, fourCC=b'DXT1', processes=1, filter="box", gamma=False):
+
+    # Compresses a BMP file, or an RGB or RGBA array, to a DDS file with all
+    # its mipmap levels, built by buildMipmaps(..., filter, gamma). The
+    # strips of the levels are encoded across processes ; processes=None
+    # uses every core.
+    # Returns the PSNR of the RGB of every level, largest first.
+    if isinstance(fourCC, str): fourCC = fourCC.encode()
+    if isinstance(source, str): source = readBMP(source, rgb=True)
+    # Top row first, as DDS files store it
+    levels = [image[::-1] for image in buildMipmaps(source, filter, gamma)]
+    height,width = levels[0].shape[:2]
+    print("Compressing {:}x{:} texture to {:} ({:})".format(width, height, path, fourCC.decode()))
+
+    if processes is None: processes = os.cpu_count()
+    pool = multiprocessing.Pool(processes) if processes>1 else None
+    try:
+        encoded = []
+        for image in levels:
+            strips = [(fourCC,strip) for strip in _strips(image, 4*processes)]
+            parts = pool.map(_encodeStrip, strips) if pool else [_encodeStrip(s) for s in strips]
+            encoded.append(b''.join(parts))
+    finally:
+        if pool: pool.close()
+
+    writeDDS(path, fourCC, width, height, encoded)
+
+    report = []
+    for level,(image,data) in enumerate(zip(levels,encoded)):
+        decoded = decodeS3TC(fourCC, data, image.shape[1], image.shape[0])
+        report.append(psnr(image[...,:3], decoded[...,:3]))
+        print("  level {:2}  {:4}x{:<4}  {:7} bytes   PSNR {:6.2f} dB"
+                .format(level, image.shape[1], image.shape[0], len(data), report[-1]))
+    return report
+
+def main():
+
+    if len(sys.argv) not in (3,4,5):
+        print("Usage : python texturecompressor.py image.bmp texture.DDS [DXT1|DXT3|DXT5] [processes]")
+        return
+    fourCC = sys.argv[3] if len(sys.argv)>3 else 'DXT1'
+    processes = int(sys.argv[4]) if len(sys.argv)>4 else None
+    compressTexture(sys.argv[1], sys.argv[2], fourCC, processes)
+
+if __name__ == "__main__":
+
+    main()
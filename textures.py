@@ -1,45 +1,117 @@
 from OpenGL.GL import *
 from OpenGL.GL.EXT.texture_compression_s3tc import *
+from OpenGL.raw.GL.VERSION.GL_1_0 import glTexImage2D as _glTexImage2D
+from OpenGL.raw.GL.VERSION.GL_1_3 import glCompressedTexImage2D as _glCompressedTexImage2D
+import ctypes
+import mmap
+import os
 import numpy as np
-import struct
+from OpenGL.extensions import hasGLExtension
+from s3tc import decodeS3TC
+from mipmaps import cachedMipmaps
 
-def loadBMP(imagepath,trilinear=True):
+# Header of a BMP file : the 14 bytes BITMAPFILEHEADER, then the 40 bytes
+# BITMAPINFOHEADER (larger info headers begin the same way)
+bmpHeaderDtype = np.dtype([
+    ('magic', 'S2'),
+    ('fileSize', '<u4'),
+    ('reserved', '<u2', 2),
+    ('dataPos', '<u4'),
+    ('headerSize', '<u4'),
+    ('width', '<i4'),
+    ('height', '<i4'),
+    ('planes', '<u2'),
+    ('bitCount', '<u2'),
+    ('compression', '<u4'),
+    ('imageSize', '<u4'),
+    ('xPixelsPerMeter', '<i4'),
+    ('yPixelsPerMeter', '<i4'),
+    ('colorsUsed', '<u4'),
+    ('colorsImportant', '<u4'),
+    ])
 
+# BI_RGB, and BI_BITFIELDS with the masks of BGRA bytes
+_bmpMasks = (0x00FF0000, 0x0000FF00, 0x000000FF)
+
+def readBMP(imagepath, rgb=False):
+
+    # Maps the file and returns its pixels without reading or copying them :
+    # a (height,width,3) view for 24bpp files and 32bpp files without
+    # alpha, (height,width,4) for 32bpp with alpha, in the BGR(A) order of
+    # the file. The rows are in the order glTexImage2D takes them, bottom
+    # row first : the view runs backwards over top-down files.
+    # rgb=True gives the channels in RGB(A) order instead.
     print("Reading image {:}".format(imagepath))
+    fp = _openImage(imagepath)
+    fileSize = os.fstat(fp.fileno()).st_size
+    if fileSize<bmpHeaderDtype.itemsize:
+        fp.close()
+        raise RuntimeError("{:} is not a correct BMP file".format(imagepath))
+    mapping = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    fp.close()
 
-    # Open the file
-    try: file = open(imagepath,'rb')
-    except:
-        raise RuntimeError(
-                "{:} could not be opened. Are you in the right directory? Don't forget to read the FAQ!"
+    header = np.frombuffer(mapping, dtype=bmpHeaderDtype, count=1)[0]
+    width,height = int(header['width']),int(header['height'])
+    bitCount,compression = int(header['bitCount']),int(header['compression'])
+    # Some BMP files are misformatted, guess missing information
+    dataPos = int(header['dataPos']) or bmpHeaderDtype.itemsize
+
+    # The masks follow a BITMAPINFOHEADER, or are part of larger headers
+    alpha = False
+    if compression==3 and bitCount==32:
+        masks = np.frombuffer(mapping, dtype='<u4', count=4, offset=bmpHeaderDtype.itemsize).tolist()
+        alpha = int(header['headerSize'])>40 and masks[3]==0xFF000000
+        if tuple(masks[:3])!=_bmpMasks: compression = -1
+    del header
+
+    if mapping[:2]!=b'BM' or bitCount not in (24,32) or compression not in (0,3) or width<=0 or height==0:
+        mapping.close()
+        raise RuntimeError("{:} is not a correct BMP file : only 24 and 32bpp uncompressed files are supported"
                 .format(imagepath))
 
-    # Read the header, i.e. the 54 first bytes
-    header = file.read(54)
+    # Rows are padded to 4 bytes, and stored bottom row first unless the
+    # height is negative
+    pixelSize = bitCount//8
+    rowSize = (width*pixelSize+3)//4*4
+    topDown = height<0
+    height = abs(height)
+    if dataPos+rowSize*(height-1)+width*pixelSize>fileSize:
+        mapping.close()
+        raise RuntimeError("{:} is truncated".format(imagepath))
 
-    # If less than 54 bytes are read, problem
-    assert len(header)==54, "Not a correct BMP file"
-    # A BMP files always begins with "BM"
-    assert struct.unpack('2s',header[:2])[0]==b'BM', "Not a correct BMP file"
-    # Make sure this is a 24bpp file
-    assert struct.unpack('i',header[0x1E:0x22])[0]==0 , "Not a correct BMP file"
-    assert struct.unpack('i',header[0x1C:0x20])[0]==24, "Not a correct BMP file"
+    # The view keeps the mapping open until it is freed
+    pixels = np.ndarray((height,width,pixelSize), dtype=np.uint8, buffer=mapping,
+            offset=dataPos, strides=(rowSize,pixelSize,1))
+    if topDown: pixels = pixels[::-1]
+    if pixelSize==4 and not alpha: pixels = pixels[...,:3]
+    if rgb: pixels = pixels[...,2::-1] if pixels.shape[2]==3 else pixels[...,[2,1,0,3]]
+    return pixels
 
-    # Read the information about the image
-    dataPos    = struct.unpack('i',header[0x0A:0x0E])[0]
-    imageSize  = struct.unpack('i',header[0x22:0x26])[0]
-    width      = struct.unpack('i',header[0x12:0x16])[0]
-    height     = struct.unpack('i',header[0x16:0x1A])[0]
+def _uploadLevel(level, image, internalFormat):
+    # Gives a (height,width,3|4) BGR(A) level to OpenGL straight from its
+    # memory when its rows are laid out as OpenGL reads them : 3 or 4 bytes
+    # per pixel, rows packed or 4 bytes aligned. Others are copied first,
+    # like the flipped rows of top-down files.
+    height,width = image.shape[:2]
+    rowSize,pixelSize,channelSize = image.strides
+    packed = width*pixelSize
+    if channelSize!=1 or pixelSize not in (3,4) or rowSize not in (packed,(packed+3)//4*4):
+        image = np.ascontiguousarray(image)
+        rowSize,pixelSize = image.strides[:2]
+    glPixelStorei(GL_UNPACK_ROW_LENGTH, 0)
+    glPixelStorei(GL_UNPACK_ALIGNMENT, 4 if rowSize%4==0 else 1)
+    dataFormat = GL_BGRA if pixelSize==4 else GL_BGR
+    _glTexImage2D(GL_TEXTURE_2D, level, internalFormat, width, height, 0, dataFormat, GL_UNSIGNED_BYTE,
+            ctypes.c_void_p(image.ctypes.data))
 
-    # Some BMP files are misformatted, guess missing information
-    if imageSize==0: imageSize = width*height*3 # 3 : one byte for each Red, Green and Blue component
-    if dataPos==0:   dataPos = 54 # The BMP header is done that way
+def loadBMP(imagepath,trilinear=True,filter="box",gamma=False):
 
-    # Read the actual data from the file into the buffer
-    data = file.read(imageSize)
+    pixels = readBMP(imagepath)
+    internalFormat = GL_RGBA if pixels.shape[2]==4 else GL_RGB
 
-    # Everything is in memory now, the file wan be closed
-    file.close()
+    # The mipmaps are built on the CPU, with the filter of mipmaps.py, and
+    # cached next to the file
+    levels = cachedMipmaps(imagepath, pixels, filter, gamma) if trilinear else [pixels]
 
     # Create one OpenGL texture
     textureID = glGenTextures(1)
@@ -47,11 +119,21 @@ def loadBMP(imagepath,trilinear=True):
     # "Bind" the newly created texture : all future texture functions will modify this texture
     glBindTexture(GL_TEXTURE_2D, textureID)
 
-    # Give the image to OpenGL
-    glTexImage2D(GL_TEXTURE_2D, 0,GL_RGB, width, height, 0, GL_BGR, GL_UNSIGNED_BYTE, data);
+    # Give the image to OpenGL, straight from the mapping of the file, and
+    # its mipmaps from the mapping of the cache. _uploadLevel sets the unpack
+    # state of each level : the caller's is restored afterwards.
+    alignment = glGetIntegerv(GL_UNPACK_ALIGNMENT)
+    rowLength = glGetIntegerv(GL_UNPACK_ROW_LENGTH)
+    try:
+        for level,image in enumerate(levels):
+            _uploadLevel(level, image, internalFormat)
+    finally:
+        glPixelStorei(GL_UNPACK_ALIGNMENT, alignment)
+        glPixelStorei(GL_UNPACK_ROW_LENGTH, rowLength)
+    glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAX_LEVEL, len(levels)-1)
 
-    # OpenGL has now copied the data. Free our own version
-    del data
+    # OpenGL has now copied the data. Free our own version, and the mappings
+    del pixels,levels,image
 
     if not trilinear:
         # Poor filtering, or ...
@@ -64,75 +146,174 @@ def loadBMP(imagepath,trilinear=True):
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT)
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
         glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR)
-        glGenerateMipmap(GL_TEXTURE_2D)
 
     # Return the ID of the texture we just created
     return textureID
 
-def loadDDS(imagepath):
+# Header of a DDS file : the "DDS " magic, then the 124 bytes DDS_HEADER
+ddsHeaderDtype = np.dtype([
+    ('magic', 'S4'),
+    ('size', '<u4'),
+    ('flags', '<u4'),
+    ('height', '<u4'),
+    ('width', '<u4'),
+    ('pitchOrLinearSize', '<u4'),
+    ('depth', '<u4'),
+    ('mipMapCount', '<u4'),
+    ('reserved1', '<u4', 11),
+    ('pfSize', '<u4'),
+    ('pfFlags', '<u4'),
+    ('fourCC', 'S4'),
+    ('rgbBitCount', '<u4'),
+    ('masks', '<u4', 4),
+    ('caps', '<u4', 4),
+    ('reserved2', '<u4'),
+    ])
 
-    # try to open the file
-    try: fp = open(imagepath,'rb')
-    except:
+# Bytes per 4x4 block of each compressed format
+_ddsBlockSizes = {b'DXT1': 8, b'DXT3': 16, b'DXT5': 16}
+
+def _openImage(imagepath):
+    try: return open(imagepath,'rb')
+    except OSError:
         raise RuntimeError(
                 "{:} could not be opened. Are you in the right directory? Don't forget to read the FAQ!"
                 .format(imagepath))
 
-    # verify the type of file
-    filecode = fp.read(4)
-    if filecode!=b"DDS ":
-        fp.close()
+def _ddsLevels(imagepath, header, fileSize):
+    # (width, height, offset, size) of every mipmap level, from the block
+    # format : each level is made of whole 4x4 blocks
+    if header['magic']!=b"DDS ":
         raise RuntimeError("{:} appears not to be a DDS file".format(imagepath))
+    fourCC = bytes(header['fourCC'])
+    if fourCC not in _ddsBlockSizes:
+        raise RuntimeError("Didn't understand format code: {:}".format(fourCC))
+    blockSize = _ddsBlockSizes[fourCC]
 
-    # get the surface desc 
-    header = fp.read(124)
+    width,height = int(header['width']),int(header['height'])
+    levels = []
+    offset = ddsHeaderDtype.itemsize
+    for level in range(max(int(header['mipMapCount']),1)):
+        size = ((width+3)//4)*((height+3)//4)*blockSize
+        levels.append((width, height, offset, size))
+        offset += size
+        if width==1 and height==1: break
+        # Deal with Non-Power-Of-Two textures
+        width,height = max(width//2,1),max(height//2,1)
 
-    height      = struct.unpack( 'I',header[ 8:12])[0]
-    width       = struct.unpack( 'I',header[12:16])[0]
-    linearSize  = struct.unpack( 'I',header[16:20])[0]
-    mipMapCount = struct.unpack( 'I',header[24:28])[0]
-    fourCC      = struct.unpack('4s',header[80:84])[0]
+    if offset>fileSize:
+        raise RuntimeError("{:} is truncated : {:} bytes for {:} levels, {:} expected"
+                .format(imagepath, fileSize, len(levels), offset))
+    return fourCC,levels
 
-    # how big is it going to be including all mipmaps?
-    if mipMapCount>1: bufsize = linearSize*2
-    else: bufsize = linearSize
-    data = fp.read(bufsize)
+def probeDDS(imagepath):
 
-    # close the file pointer
+    # Reads the header only. Returns the format code (b'DXT1', b'DXT3' or
+    # b'DXT5') and the (width, height, offset, size) in the file of every
+    # mipmap level, to plan uploads before reading any pixel.
+    fp = _openImage(imagepath)
+    data = fp.read(ddsHeaderDtype.itemsize)
+    fileSize = os.fstat(fp.fileno()).st_size
     fp.close()
+    if len(data)<ddsHeaderDtype.itemsize:
+        raise RuntimeError("{:} appears not to be a DDS file".format(imagepath))
+    return _ddsLevels(imagepath, np.frombuffer(data, dtype=ddsHeaderDtype)[0], fileSize)
 
-    if fourCC=='DXT1': components = 3
-    else: components = 4
-    try: dxformat = {
-        b'DXT1' : GL_COMPRESSED_RGBA_S3TC_DXT1_EXT,
-        b'DXT3' : GL_COMPRESSED_RGBA_S3TC_DXT3_EXT,
-        b'DXT5' : GL_COMPRESSED_RGBA_S3TC_DXT5_EXT,
-        }[fourCC]
-    except:
-        raise RuntimeError("Didn't understand format code: {:}".format(fourCC))
+def writeDDS(imagepath, fourCC, width, height, levels):
 
-    # Create one OpenGL texture
-    textureID = glGenTextures(1)
+    # Writes a DDS file of the compressed levels (bytes, largest first) of a
+    # width x height texture in the fourCC format, as loadDDS reads them
+    header = np.zeros(1, dtype=ddsHeaderDtype)[0]
+    header['magic'] = b"DDS "
+    header['size'] = ddsHeaderDtype.itemsize-4
+    # CAPS, HEIGHT, WIDTH, PIXELFORMAT, MIPMAPCOUNT and LINEARSIZE
+    header['flags'] = 0x1|0x2|0x4|0x1000|0x20000|0x80000
+    header['height'],header['width'] = height,width
+    header['pitchOrLinearSize'] = len(levels[0])
+    header['mipMapCount'] = len(levels)
+    header['pfSize'] = 32
+    header['pfFlags'] = 0x4 # FOURCC
+    header['fourCC'] = fourCC
+    # TEXTURE, COMPLEX and MIPMAP
+    header['caps'][0] = 0x1000|0x8|0x400000
 
-    # "Bind" the newly created texture : all future texture functions will modify this texture
-    glBindTexture(GL_TEXTURE_2D, textureID)
-    glPixelStorei(GL_UNPACK_ALIGNMENT,1)
+    fp = open(imagepath,'wb')
+    fp.write(header.tobytes())
+    for level in levels: fp.write(level)
+    fp.close()
 
-    if dxformat==GL_COMPRESSED_RGBA_S3TC_DXT1_EXT: blockSize = 8
-    else: blockSize = 16
-    offset = 0
+def s3tcSupported():
+    return bool(hasGLExtension("GL_EXT_texture_compression_s3tc"))
 
-    # load the mipmaps
-    for level in range(mipMapCount):
-        size = ((width+3)//4)*((height+3)//4)*blockSize
-        glCompressedTexImage2D(GL_TEXTURE_2D, level, dxformat, width, height, 0, size, data[offset:offset+size])
-        
-        offset += size
-        width  /= 2
-        height /= 2
-        
-        # Deal with Non-Power-Of-Two textures. This code is not included in the webpage to reduce clutter.
-        if width<1: width = 1
-        if height<1: height = 1
+def decodeDDS(imagepath):
+
+    # Decodes every mipmap level of a DDS file on the CPU, see s3tc.py.
+    # Returns the format code and a list of (height,width,4) uint8 RGBA
+    # arrays, largest level first.
+    fp = _openImage(imagepath)
+    data = fp.read()
+    fp.close()
+    if len(data)<ddsHeaderDtype.itemsize:
+        raise RuntimeError("{:} appears not to be a DDS file".format(imagepath))
+    fourCC,levels = _ddsLevels(imagepath, np.frombuffer(data, dtype=ddsHeaderDtype, count=1)[0], len(data))
+    return fourCC,[decodeS3TC(fourCC, data[offset:offset+size], width, height)
+            for width,height,offset,size in levels]
+
+def loadDDS(imagepath, decode=None):
+
+    # The file is memory mapped, and every mipmap level goes to OpenGL
+    # straight from the mapping : nothing is read or copied in Python.
+    # Without S3TC support in the driver (or with decode=True), the levels
+    # are decoded on the CPU and uploaded as plain RGBA instead.
+    if decode is None: decode = not s3tcSupported()
+    fp = _openImage(imagepath)
+    fileSize = os.fstat(fp.fileno()).st_size
+    if fileSize<ddsHeaderDtype.itemsize:
+        fp.close()
+        raise RuntimeError("{:} appears not to be a DDS file".format(imagepath))
+    mapping = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    fp.close()
+    view = np.frombuffer(mapping, dtype=np.uint8)
+
+    try:
+        header = np.frombuffer(mapping[:ddsHeaderDtype.itemsize], dtype=ddsHeaderDtype)[0]
+        fourCC,levels = _ddsLevels(imagepath, header, fileSize)
+        dxformat = {
+            b'DXT1' : GL_COMPRESSED_RGBA_S3TC_DXT1_EXT,
+            b'DXT3' : GL_COMPRESSED_RGBA_S3TC_DXT3_EXT,
+            b'DXT5' : GL_COMPRESSED_RGBA_S3TC_DXT5_EXT,
+            }[fourCC]
+
+        # Create one OpenGL texture
+        textureID = glGenTextures(1)
+
+        # "Bind" the newly created texture : all future texture functions will modify this texture
+        glBindTexture(GL_TEXTURE_2D, textureID)
+        glPixelStorei(GL_UNPACK_ALIGNMENT,1)
+
+        # load the mipmaps, through the raw entry point which takes a
+        # pointer : the address of the level in the mapping
+        base = view.ctypes.data
+        if decode: print("Decoding {:} ({:}) on the CPU".format(imagepath, fourCC.decode()))
+        for level,(width,height,offset,size) in enumerate(levels):
+            if decode:
+                rgba = decodeS3TC(fourCC, view[offset:offset+size], width, height)
+                glTexImage2D(GL_TEXTURE_2D, level, GL_RGBA8, width, height, 0, GL_RGBA, GL_UNSIGNED_BYTE, rgba)
+                del rgba
+            else:
+                _glCompressedTexImage2D(GL_TEXTURE_2D, level, dxformat, width, height, 0, size,
+                        ctypes.c_void_p(base+offset))
+
+        # Files may stop before the 1x1 level
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAX_LEVEL, len(levels)-1)
+
+    finally:
+        # The mapping can only be closed once no array uses it. When an
+        # error is on its way out, its traceback may still hold slices of
+        # the view (in decodeS3TC...) : the mapping is then closed when they
+        # are freed, rather than hiding the error behind a BufferError.
+        view = rgba = None
+        try: mapping.close()
+        except BufferError: pass
 
     return textureID
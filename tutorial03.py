@@ -79,7 +79,7 @@ def main():
 
         # Send our transformation to the currently bound shader, 
         # in the "MVP" uniform
-        shader.setUniform("MVP", "mat4", MVP)
+        shader.setUniform("MVP", MVP)
 
         glEnableVertexAttribArray(0)
         glBindBuffer(GL_ARRAY_BUFFER, vbo)
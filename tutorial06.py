@@ -164,14 +164,14 @@ def main():
 
         # Send our transformation to the currently bound shader, 
         # in the "MVP" uniform
-        shader.setUniform("MVP", "mat4", controls.MVP)
+        shader.setUniform("MVP", controls.MVP)
 
         # Bind our texture in Texture Unit 0
         glActiveTexture(GL_TEXTURE0)
         glBindTexture(GL_TEXTURE_2D, Texture)
 
         # Set our "myTextureSampler" sampler to user Texture Unit 0
-        shader.setUniform("myTextureSampler","sampler2D",0)
+        shader.setUniform("myTextureSampler",0)
 
         glEnableVertexAttribArray(0)
         glBindBuffer(GL_ARRAY_BUFFER, vbo)
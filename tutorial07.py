@@ -3,7 +3,7 @@ from OpenGL.GL import *
 from shader import Shader
 from textures import loadBMP,loadDDS
 from controls import Controls
-from objloader import loadOBJ
+from meshcache import loadOBJCached
 import numpy as np
 import struct
 
@@ -60,8 +60,8 @@ def main():
     #Texture = loadBMP("uvtemplate.bmp")
     Texture = loadDDS("uvmap.DDS")
 
-    # Read our .obj file
-    vertices, uvs, normals = loadOBJ("cube.obj",invert_v=True)
+    # Read our .obj file (cached on disk after the first run)
+    vertices, uvs, normals = loadOBJCached("cube.obj",invert_v=True)
 
     # Create the vertex buffer object
     vbo = glGenBuffers(1)
@@ -88,14 +88,14 @@ def main():
 
         # Send our transformation to the currently bound shader, 
         # in the "MVP" uniform
-        shader.setUniform("MVP", "mat4", controls.MVP)
+        shader.setUniform("MVP", controls.MVP)
 
         # Bind our texture in Texture Unit 0
         glActiveTexture(GL_TEXTURE0)
         glBindTexture(GL_TEXTURE_2D, Texture)
 
         # Set our "myTextureSampler" sampler to user Texture Unit 0
-        shader.setUniform("myTextureSampler","sampler2D",0)
+        shader.setUniform("myTextureSampler",0)
 
         glEnableVertexAttribArray(0)
         glBindBuffer(GL_ARRAY_BUFFER, vbo)
@@ -3,7 +3,9 @@ from OpenGL.GL import *
 from shader import Shader
 from textures import loadBMP,loadDDS
 from controls import Controls
-from objloader import loadOBJ
+from meshcache import loadOBJCached
+from vboindexer import attributeOffset
+import ctypes
 import numpy as np
 import struct
 
@@ -59,24 +61,15 @@ def main():
     # Load the texture using any two methods
     Texture = loadDDS("uvmap2.DDS")
 
-    # Read our .obj file
-    vertices, uvs, normals = loadOBJ("suzanne.obj",invert_v=True)
+    # Read our .obj file (cached on disk after the first run), with the
+    # position, uv and normal of each vertex interleaved
+    vertices = loadOBJCached("suzanne.obj",invert_v=True,interleaved=True)
 
-    # Create the vertex buffer object
+    # Create the vertex buffer object, for all the attributes
     vbo = glGenBuffers(1)
     glBindBuffer(GL_ARRAY_BUFFER, vbo)
     glBufferData(GL_ARRAY_BUFFER, vertices.nbytes, vertices, GL_STATIC_DRAW)
 
-    # Create the uv buffer object
-    uvbo = glGenBuffers(1)
-    glBindBuffer(GL_ARRAY_BUFFER, uvbo)
-    glBufferData(GL_ARRAY_BUFFER, uvs.nbytes, uvs, GL_STATIC_DRAW)
-
-    # Create normal buffer object
-    nbo = glGenBuffers(1)
-    glBindBuffer(GL_ARRAY_BUFFER, nbo)
-    glBufferData(GL_ARRAY_BUFFER, normals.nbytes, normals, GL_STATIC_DRAW)
-
     # Loop until the user closes the window
     while( glfw.get_key(window, glfw.KEY_ESCAPE ) != glfw.PRESS and
             glfw.window_should_close(window) == 0 ):
@@ -92,53 +85,54 @@ def main():
 
         # Send our transformation to the currently bound shader, 
         # in the "MVP" uniform
-        shader.setUniform("V", "mat4", np.array(controls.ViewMatrix,dtype=np.float32))
-        shader.setUniform("M", "mat4", np.array(controls.ModelMatrix,dtype=np.float32))
-        shader.setUniform("MVP", "mat4", controls.MVP)
+        shader.setUniform("V", np.array(controls.ViewMatrix,dtype=np.float32))
+        shader.setUniform("M", np.array(controls.ModelMatrix,dtype=np.float32))
+        shader.setUniform("MVP", controls.MVP)
 
-        shader.setUniform("LightPosition_worldspace", "vec3", 
-                np.array([4,4,4],dtype=np.float32))
+        shader.setUniform("LightPosition_worldspace", np.array([4,4,4],dtype=np.float32))
 
         # Bind our texture in Texture Unit 0
         glActiveTexture(GL_TEXTURE0)
         glBindTexture(GL_TEXTURE_2D, Texture)
 
         # Set our "myTextureSampler" sampler to user Texture Unit 0
-        shader.setUniform("myTextureSampler","sampler2D",0)
+        shader.setUniform("myTextureSampler",0)
 
-        glEnableVertexAttribArray(0)
+        # One buffer holds the interleaved vertices : each attribute reads it
+        # with the size of a vertex as stride, from its own offset
         glBindBuffer(GL_ARRAY_BUFFER, vbo)
+
+        # 1rst attribute : vertices
+        glEnableVertexAttribArray(0)
         glVertexAttribPointer(
-                0,         # attribute 0.
+                0,         # attribute.
                 3,         # size
                 GL_FLOAT,  # type
                 GL_FALSE,  # normalized?
-                0,         # stride
-                None       # array buffer offset
+                vertices.itemsize, # stride
+                ctypes.c_void_p(attributeOffset(vertices,"position")) # array buffer offset
         )
 
-        # 2nd attribute buffer : UVs
+        # 2nd attribute : UVs
         glEnableVertexAttribArray(1)
-        glBindBuffer(GL_ARRAY_BUFFER, uvbo)
         glVertexAttribPointer(
                 1,         # attribute.
                 2,         # size
                 GL_FLOAT,  # type
                 GL_FALSE,  # normalized?
-                0,         # stride
-                None       # array buffer offset
+                vertices.itemsize, # stride
+                ctypes.c_void_p(attributeOffset(vertices,"uv")) # array buffer offset
         )
 
-        # 3rd attribute buffer : UVs
+        # 3rd attribute : normals
         glEnableVertexAttribArray(2)
-        glBindBuffer(GL_ARRAY_BUFFER, nbo)
         glVertexAttribPointer(
                 2,         # attribute.
                 3,         # size
                 GL_FLOAT,  # type
                 GL_FALSE,  # normalized?
-                0,         # stride
-                None       # array buffer offset
+                vertices.itemsize, # stride
+                ctypes.c_void_p(attributeOffset(vertices,"normal")) # array buffer offset
         )
         
         # Draw the triangle !
@@ -146,6 +140,7 @@ def main():
 
         glDisableVertexAttribArray(0)
         glDisableVertexAttribArray(1)
+        glDisableVertexAttribArray(2)
     
         # Swap front and back buffers
         glfw.swap_buffers(window)
@@ -3,8 +3,7 @@ from OpenGL.GL import *
 from shader import Shader
 from textures import loadBMP,loadDDS
 from controls import Controls
-from objloader import loadOBJ
-from vboindexer import indexVBO
+from mesh import loadMesh
 import numpy as np
 
 def main():
@@ -46,9 +45,6 @@ def main():
     # Accept fragment if it closer to the camera than the former one
     glDepthFunc(GL_LESS)
 
-    vao = glGenVertexArrays(1)
-    glBindVertexArray(vao)
-
     # Create and compile our GLSL program from the shaders
     shader = Shader("StandardShading.vertexshader", "StandardShading.fragmentshader")
     shader.compile()
@@ -59,30 +55,10 @@ def main():
     # Load the texture using any two methods
     Texture = loadDDS("uvmap2.DDS")
 
-    # Read our .obj file
-    vertices, uvs, normals = loadOBJ("suzanne.obj",invert_v=True)
-
-    indices,indexed_vertices,indexed_uvs,indexed_normals = indexVBO(vertices,uvs,normals)
-
-    # Create the vertex buffer object
-    vbo = glGenBuffers(1)
-    glBindBuffer(GL_ARRAY_BUFFER, vbo)
-    glBufferData(GL_ARRAY_BUFFER, indexed_vertices.nbytes, indexed_vertices, GL_STATIC_DRAW)
-
-    # Create the uv buffer object
-    uvbo = glGenBuffers(1)
-    glBindBuffer(GL_ARRAY_BUFFER, uvbo)
-    glBufferData(GL_ARRAY_BUFFER, indexed_uvs.nbytes, indexed_uvs, GL_STATIC_DRAW)
-
-    # Create normal buffer object
-    nbo = glGenBuffers(1)
-    glBindBuffer(GL_ARRAY_BUFFER, nbo)
-    glBufferData(GL_ARRAY_BUFFER, indexed_normals.nbytes, indexed_normals, GL_STATIC_DRAW)
-
-    # Generate a buffer for the indices as well
-    ibo = glGenBuffers(1)
-    glBindBuffer(GL_ARRAY_BUFFER, ibo)
-    glBufferData(GL_ARRAY_BUFFER, indices.nbytes, indices, GL_STATIC_DRAW)
+    # Read our .obj file, already indexed. The result is cached on disk, so
+    # only the first run pays for the parsing and the indexing. The mesh
+    # uploads its buffers and records its attributes in its own VAO once.
+    mesh = loadMesh("suzanne.obj",invert_v=True)
 
     # For speed computation
     lastTime = glfw.get_time()
@@ -98,7 +74,9 @@ def main():
         if currentTime-lastTime >= 1.0: 
             # If last prinf() was more than 1sec ago
             # printf and reset
-            print("{:.5f} ms/frame".format(1000.0/float(nbFrames)))
+            # and how many uniform uploads were skipped as redundant
+            print("{:.5f} ms/frame, uniforms {:} sent {:} skipped".format(
+                1000.0/float(nbFrames), shader.uploads, shader.skippedUploads))
             nbFrames = 0
             lastTime += 1.0
         
@@ -113,69 +91,21 @@ def main():
 
         # Send our transformation to the currently bound shader, 
         # in the "MVP" uniform
-        shader.setUniform("V", "mat4", np.array(controls.ViewMatrix,dtype=np.float32))
-        shader.setUniform("M", "mat4", np.array(controls.ModelMatrix,dtype=np.float32))
-        shader.setUniform("MVP", "mat4", controls.MVP)
+        shader.setUniform("V", np.array(controls.ViewMatrix,dtype=np.float32))
+        shader.setUniform("M", np.array(controls.ModelMatrix,dtype=np.float32))
+        shader.setUniform("MVP", controls.MVP)
 
-        shader.setUniform("LightPosition_worldspace", "vec3", 
-                np.array([4,4,4],dtype=np.float32))
+        shader.setUniform("LightPosition_worldspace", np.array([4,4,4],dtype=np.float32))
 
         # Bind our texture in Texture Unit 0
         glActiveTexture(GL_TEXTURE0)
         glBindTexture(GL_TEXTURE_2D, Texture)
 
         # Set our "myTextureSampler" sampler to user Texture Unit 0
-        shader.setUniform("myTextureSampler","sampler2D",0)
-
-        glEnableVertexAttribArray(0)
-        glBindBuffer(GL_ARRAY_BUFFER, vbo)
-        glVertexAttribPointer(
-                0,         # attribute 0.
-                3,         # size
-                GL_FLOAT,  # type
-                GL_FALSE,  # normalized?
-                0,         # stride
-                None       # array buffer offset
-        )
-
-        # 2nd attribute buffer : UVs
-        glEnableVertexAttribArray(1)
-        glBindBuffer(GL_ARRAY_BUFFER, uvbo)
-        glVertexAttribPointer(
-                1,         # attribute.
-                2,         # size
-                GL_FLOAT,  # type
-                GL_FALSE,  # normalized?
-                0,         # stride
-                None       # array buffer offset
-        )
-
-        # 3rd attribute buffer : UVs
-        glEnableVertexAttribArray(2)
-        glBindBuffer(GL_ARRAY_BUFFER, nbo)
-        glVertexAttribPointer(
-                2,         # attribute.
-                3,         # size
-                GL_FLOAT,  # type
-                GL_FALSE,  # normalized?
-                0,         # stride
-                None       # array buffer offset
-        )
-        
-        # Index buffer
-        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, ibo)
+        shader.setUniform("myTextureSampler",0)
 
         # Draw the triangles !
-        glDrawElements(
-            GL_TRIANGLES,      # mode
-            len(indices),      # count
-            GL_UNSIGNED_SHORT, # type
-            None               # element array buffer offset
-        )
-
-        glDisableVertexAttribArray(0)
-        glDisableVertexAttribArray(1)
-        glDisableVertexAttribArray(2)
+        mesh.draw()
     
         # Swap front and back buffers
         glfw.swap_buffers(window)
@@ -183,6 +113,7 @@ def main():
         # Poll for and process events
         glfw.poll_events()
 
+    mesh.close()
     glfw.terminate()
 
 if __name__ == "__main__":
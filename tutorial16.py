@@ -1,10 +1,9 @@
 import glfw
 from OpenGL.GL import *
-from shader import Shader
+from shader import Shader,loadShader
 from textures import loadBMP,loadDDS
 from controls import *
-from objloader import loadOBJ
-from vboindexer import indexVBO
+from mesh import loadMesh
 import numpy as np
 
 def main():
@@ -54,9 +53,6 @@ def main():
     # Accept fragment if it closer to the camera than the former one
     glDepthFunc(GL_LESS)
 
-    vao = glGenVertexArrays(1)
-    glBindVertexArray(vao)
-
     # Create and compile our GLSL program from the shaders
     depth_shader = Shader("DepthRTT.vertexshader", "DepthRTT.fragmentshader")
     depth_shader.compile()
@@ -67,30 +63,10 @@ def main():
     # Load the texture using any two methods
     Texture = loadDDS("uvmap3.DDS")
 
-    # Read our .obj file
-    vertices, uvs, normals = loadOBJ("room_thickwalls.obj",invert_v=True)
-
-    indices,indexed_vertices,indexed_uvs,indexed_normals = indexVBO(vertices,uvs,normals)
-
-    # Create the vertex buffer object
-    vbo = glGenBuffers(1)
-    glBindBuffer(GL_ARRAY_BUFFER, vbo)
-    glBufferData(GL_ARRAY_BUFFER, indexed_vertices.nbytes, indexed_vertices, GL_STATIC_DRAW)
-
-    # Create the uv buffer object
-    uvbo = glGenBuffers(1)
-    glBindBuffer(GL_ARRAY_BUFFER, uvbo)
-    glBufferData(GL_ARRAY_BUFFER, indexed_uvs.nbytes, indexed_uvs, GL_STATIC_DRAW)
-
-    # Create normal buffer object
-    nbo = glGenBuffers(1)
-    glBindBuffer(GL_ARRAY_BUFFER, nbo)
-    glBufferData(GL_ARRAY_BUFFER, indexed_normals.nbytes, indexed_normals, GL_STATIC_DRAW)
-
-    # Generate a buffer for the indices as well
-    ibo = glGenBuffers(1)
-    glBindBuffer(GL_ARRAY_BUFFER, ibo)
-    glBufferData(GL_ARRAY_BUFFER, indices.nbytes, indices, GL_STATIC_DRAW)
+    # Read our .obj file, already indexed. The result is cached on disk, so
+    # only the first run pays for the parsing and the indexing. The mesh
+    # uploads its buffers and records its attributes in its own VAO once.
+    mesh = loadMesh("room_thickwalls.obj",invert_v=True)
 
     # ---------------------------------------------
     # Render to Texture - specific code begins here
@@ -123,9 +99,12 @@ def main():
     if glCheckFramebufferStatus(GL_FRAMEBUFFER)!=GL_FRAMEBUFFER_COMPLETE:
         raise RuntimeError("Framebuffer not OK!")
 
-    # Create and compile our GLSL program from the shaders
-    shader = Shader( "ShadowMapping.vertexshader", "ShadowMapping.fragmentshader" )
-    shader.compile()
+    # Create and compile our GLSL program from the shaders, in 3 quality
+    # tiers : fast, medium and high use 4, 8 and 16 shadow map samples.
+    # The keys 1, 2 and 3 switch between them, already compiled.
+    shaders = [loadShader("ShadowMapping.vertexshader", "ShadowMapping.fragmentshader",
+        {"PCF_SAMPLES": n}) for n in (4, 8, 16)]
+    shader = shaders[2]
 
     # For speed computation
     lastTime = glfw.get_time()
@@ -141,10 +120,17 @@ def main():
         if currentTime-lastTime >= 1.0: 
             # If last prinf() was more than 1sec ago
             # printf and reset
-            print("{:.5f} ms/frame".format(1000.0/float(nbFrames)))
+            # and how many uniform uploads were skipped as redundant
+            print("{:.5f} ms/frame, uniforms {:} sent {:} skipped".format(
+                1000.0/float(nbFrames), shader.uploads+depth_shader.uploads,
+                shader.skippedUploads+depth_shader.skippedUploads))
             nbFrames = 0
             lastTime += 1.0
         
+        # Shadow quality
+        for key,tier in ((glfw.KEY_1,0), (glfw.KEY_2,1), (glfw.KEY_3,2)):
+            if glfw.get_key(window, key) == glfw.PRESS: shader = shaders[tier]
+
         # Render to our framebuffer
         glBindFramebuffer(GL_FRAMEBUFFER, fbo)
         glViewport(0,0,1024,1024)
@@ -173,32 +159,10 @@ def main():
 
         # Send our transformation to the currently bound shader, 
         # in the "MVP" uniform
-        depth_shader.setUniform("depthMVP", "mat4", depthMVP)
-
-        # 1rst attribute buffer : vertices
-        glEnableVertexAttribArray(0)
-        glBindBuffer(GL_ARRAY_BUFFER, vbo)
-        glVertexAttribPointer(
-            0,        # The attribute we want to configure
-            3,        # size
-            GL_FLOAT, # type
-            GL_FALSE, # normalized?
-            0,        # stride
-            None      # array buffer offset
-            )
-
-        # Index buffer
-        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, ibo)
+        depth_shader.setUniform("depthMVP", depthMVP)
 
         # Draw the triangles !
-        glDrawElements(
-            GL_TRIANGLES,      # mode
-            len(indices),      # count
-            GL_UNSIGNED_SHORT, # type
-            None               # element array buffer offset
-            )
-
-        glDisableVertexAttribArray(0)
+        mesh.draw()
 
         # Render to the screen
         glBindFramebuffer(GL_FRAMEBUFFER, 0)
@@ -230,74 +194,26 @@ def main():
 
         # Send our transformation to the currently bound shader, 
         # in the "MVP" uniform
-        shader.setUniform("V", "mat4", np.array(controls.ViewMatrix,dtype=np.float32))
-        shader.setUniform("M", "mat4", np.array(controls.ModelMatrix,dtype=np.float32))
-        shader.setUniform("MVP", "mat4", controls.MVP)
-        shader.setUniform("DepthBiasMVP", "mat4", depthBiasMVP)
+        shader.setUniform("V", np.array(controls.ViewMatrix,dtype=np.float32))
+        shader.setUniform("M", np.array(controls.ModelMatrix,dtype=np.float32))
+        shader.setUniform("MVP", controls.MVP)
+        shader.setUniform("DepthBiasMVP", depthBiasMVP)
 
-        shader.setUniform("LightInvDirection_worldspace", "vec3", 
-                np.array(lightInvDir,dtype=np.float32))
+        shader.setUniform("LightInvDirection_worldspace", np.array(lightInvDir,dtype=np.float32))
 
         # Bind our texture in Texture Unit 0
         glActiveTexture(GL_TEXTURE0)
         glBindTexture(GL_TEXTURE_2D, Texture)
 
         # Set our "myTextureSampler" sampler to user Texture Unit 0
-        shader.setUniform("myTextureSampler","sampler2D",0)
+        shader.setUniform("myTextureSampler",0)
 
         glActiveTexture(GL_TEXTURE1)
         glBindTexture(GL_TEXTURE_2D, depthTexture)
-        shader.setUniform("shadowMap", "sampler2DShadow",1)
-
-        glEnableVertexAttribArray(0)
-        glBindBuffer(GL_ARRAY_BUFFER, vbo)
-        glVertexAttribPointer(
-                0,         # attribute 0.
-                3,         # size
-                GL_FLOAT,  # type
-                GL_FALSE,  # normalized?
-                0,         # stride
-                None       # array buffer offset
-        )
-
-        # 2nd attribute buffer : UVs
-        glEnableVertexAttribArray(1)
-        glBindBuffer(GL_ARRAY_BUFFER, uvbo)
-        glVertexAttribPointer(
-                1,         # attribute.
-                2,         # size
-                GL_FLOAT,  # type
-                GL_FALSE,  # normalized?
-                0,         # stride
-                None       # array buffer offset
-        )
-
-        # 3rd attribute buffer : UVs
-        glEnableVertexAttribArray(2)
-        glBindBuffer(GL_ARRAY_BUFFER, nbo)
-        glVertexAttribPointer(
-                2,         # attribute.
-                3,         # size
-                GL_FLOAT,  # type
-                GL_FALSE,  # normalized?
-                0,         # stride
-                None       # array buffer offset
-        )
-        
-        # Index buffer
-        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, ibo)
+        shader.setUniform("shadowMap",1)
 
         # Draw the triangles !
-        glDrawElements(
-            GL_TRIANGLES,      # mode
-            len(indices),      # count
-            GL_UNSIGNED_SHORT, # type
-            None               # element array buffer offset
-        )
-
-        glDisableVertexAttribArray(0)
-        glDisableVertexAttribArray(1)
-        glDisableVertexAttribArray(2)
+        mesh.draw()
     
         # Swap front and back buffers
         glfw.swap_buffers(window)
@@ -305,6 +221,7 @@ def main():
         # Poll for and process events
         glfw.poll_events()
 
+    mesh.close()
     glfw.terminate()
 
 if __name__ == "__main__":
@@ -1,29 +1,255 @@
-import numpy as np
-import pickle
-
-def indexVBO(in_vertices,in_uvs,in_normals):
-    VertexToOutIndex = {}
-    out_vertices,out_uvs,out_normals,out_indices = [],[],[],[]
-
-    # For each input vertex
-    for i in range(len(in_vertices)):
-
-        packed = pickle.dumps([in_vertices[i], in_uvs[i], in_normals[i]])
-		
-        # Try to find a similar vertex in out_XXXX
-        if packed in VertexToOutIndex.keys():
-	    
-            # A similar vertex is already in the VBO, use it instead !
-	    out_indices.append( VertexToOutIndex[packed] )
-	
-        else:
-            
-            # If not, it needs to be added in the output data.
-	    out_vertices.append( in_vertices[i] )
-	    out_uvs     .append( in_uvs[i] )
-	    out_normals .append( in_normals[i] )
-	    newindex = np.uint16( len(out_vertices) - 1 )
-	    out_indices .append( newindex )
-	    VertexToOutIndex[ packed ] = newindex
-    
-    return np.array(out_indices),np.array(out_vertices),np.array(out_uvs),np.array(out_normals)
+import numpy as np
+from OpenGL.GL import GL_UNSIGNED_BYTE,GL_UNSIGNED_SHORT,GL_UNSIGNED_INT
+
+def uniqueRows(rows):
+    # Finds the distinct rows of a 2D array, comparing their bytes.
+    # Returns the index of the first occurrence of each distinct row, in the
+    # order they first appear, and for every row the number of its distinct
+    # row in that order.
+    rows = np.ascontiguousarray(rows)
+    return uniqueKeys(rows.view(np.dtype((np.void, rows.dtype.itemsize*rows.shape[1]))).ravel())
+
+def uniqueKeys(keys):
+    # uniqueRows for a 1D array of keys. Integer keys sort much faster than
+    # the rows of bytes of uniqueRows.
+    _,first,inverse = np.unique(keys, return_index=True, return_inverse=True)
+
+    # np.unique sorts the rows : renumber them by first occurrence
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return first[order],rank[inverse.ravel()]
+
+def indexArray(indices, vertex_count):
+    # Indices in the smallest type able to address vertex_count vertices :
+    # 16 bits up to 65536 vertices, 32 bits above
+    if vertex_count<=1<<16: return np.asarray(indices).astype(np.uint16)
+    return np.asarray(indices).astype(np.uint32)
+
+def indexType(indices):
+    # OpenGL type of an index array, to give to glDrawElements
+    try: return {
+        np.dtype(np.uint8)  : GL_UNSIGNED_BYTE,
+        np.dtype(np.uint16) : GL_UNSIGNED_SHORT,
+        np.dtype(np.uint32) : GL_UNSIGNED_INT,
+        }[np.asarray(indices).dtype]
+    except KeyError:
+        raise RuntimeError("Indices of type {:} can't be drawn".format(np.asarray(indices).dtype))
+
+# Layout of an interleaved vertex : position, uv and normal, 32 bytes
+vertexDtype = np.dtype([
+    ('position', np.float32, 3),
+    ('uv', np.float32, 2),
+    ('normal', np.float32, 3),
+    ])
+
+def interleave(vertices, uvs, normals):
+    # One structured array of (position, uv, normal) per vertex, for a
+    # single vertex buffer. The fields keep the types of the arrays, so
+    # encoded attributes (see vertexencoding.py) interleave as well.
+    arrays = [np.asarray(a) for a in (vertices,uvs,normals)]
+    dtype = np.dtype([(name, a.dtype, a.shape[1:]) for name,a in zip(vertexDtype.names,arrays)])
+    out = np.empty(len(arrays[0]), dtype=dtype)
+    for name,a in zip(dtype.names,arrays): out[name] = a
+    return out
+
+def attributeOffset(vertices, name):
+    # Byte offset of the field name in an interleaved vertex, to give to
+    # glVertexAttribPointer along with the stride vertices.itemsize
+    return vertices.dtype.fields[name][1]
+
+def _bytes(a):
+    # View the rows of an array as rows of bytes
+    a = np.ascontiguousarray(a)
+    # The width is explicit : -1 can't be inferred for 0 rows
+    return a.reshape(len(a),int(np.prod(a.shape[1:]))).view(np.uint8)
+
+def indexVBO(in_vertices,in_uvs,in_normals,interleaved=False):
+
+    # Pack the position, uv and normal of every vertex in one row of bytes :
+    # two vertices can share their index if these rows are identical
+    packed = np.concatenate((_bytes(in_vertices),_bytes(in_uvs),_bytes(in_normals)),axis=1)
+
+    # Keep the first occurrence of each distinct vertex, in order. The
+    # index of each input vertex is the number of its distinct vertex.
+    first,out_indices = uniqueRows(packed)
+
+    if interleaved:
+        # The indices and a single array of interleaved vertices
+        return (
+                indexArray(out_indices, len(first)),
+                interleave(np.asarray(in_vertices)[first], np.asarray(in_uvs)[first],
+                    np.asarray(in_normals)[first])
+                )
+
+    return (
+            indexArray(out_indices, len(first)),
+            np.asarray(in_vertices)[first],
+            np.asarray(in_uvs)[first],
+            np.asarray(in_normals)[first]
+            )
+
+def _countVertices(indices, start, end):
+    # Number of distinct vertices used by the triangles start to end
+    return len(np.unique(indices[3*start:3*end]))
+
+def splitMesh(indices, vertices, uvs, normals, max_vertices=1<<16):
+
+    # Cuts an indexed mesh in sub-meshes of at most max_vertices vertices
+    # each, so that they can all be drawn with 16-bit indices. Triangles keep
+    # their order. Returns a list of (indices,vertices,uvs,normals).
+    indices = np.asarray(indices)
+    ntriangles = len(indices)//3
+    meshes = []
+
+    start = 0
+    while start<ntriangles:
+
+        # max_vertices//3 triangles always fit. Then grow the sub-mesh while
+        # it fits, and find where it stops fitting by bisection.
+        low = min(start+max(max_vertices//3,1), ntriangles)
+        high = low
+        while high<ntriangles and _countVertices(indices,start,high)<=max_vertices:
+            low,high = high,min(high+2*(high-start),ntriangles)
+        if _countVertices(indices,start,high)<=max_vertices: low = high
+        while high-low>1:
+            middle = (low+high)//2
+            if _countVertices(indices,start,middle)<=max_vertices: low = middle
+            else: high = middle
+
+        # Renumber the vertices of the sub-mesh
+        used,local = np.unique(indices[3*start:3*low], return_inverse=True)
+        meshes.append((
+                indexArray(local.ravel(), len(used)),
+                vertices[used],
+                uvs[used],
+                normals[used]
+                ))
+        start = low
+
+    return meshes
+
+# Offsets to half of the 26 cells around a cell of the welding grid : the
+# other half are the opposite offsets, seen from the other cell
+_neighborCells = np.stack(np.meshgrid([-1,0,1],[-1,0,1],[-1,0,1],indexing='ij'),axis=-1).reshape(-1,3)[14:]
+
+def _cellKeys(positions, cell):
+    # Spatial hash of the grid cell of every position : its integer
+    # coordinates packed in 21 bits each. Cells grow if the grid would need
+    # more, which only brings in more candidates.
+    low = positions.min(axis=0)
+    extent = (positions.max(axis=0)-low).max()
+    cell = max(cell, extent/((1<<21)-4))
+    cells = np.floor((positions-low)/cell).astype(np.int64)+1
+    return (cells[:,0]<<42)|(cells[:,1]<<21)|cells[:,2]
+
+def _cellPairs(cell_a, cell_b, start, count, order):
+    # All the pairs of vertices (one of cell_a, one of cell_b) of the grid
+    na,nb = count[cell_a],count[cell_b]
+    total = na*nb
+    k = np.arange(total.sum()) - np.repeat(np.cumsum(total)-total, total)
+    nbr = np.repeat(nb, total)
+    return (
+            order[np.repeat(start[cell_a], total) + k//nbr],
+            order[np.repeat(start[cell_b], total) + k%nbr]
+            )
+
+def _similarPairs(positions, attributes, epsilons, cell):
+    # Every pair (i,j), j<i, of vertices whose attributes are all within
+    # their epsilon of each other, component by component. Candidates are
+    # the vertices of the same and of the neighbor cells of a uniform grid.
+    if len(positions)==0:
+        none = np.zeros(0, dtype=np.int64)
+        return none,none
+    keys = _cellKeys(positions, cell)
+    order = np.argsort(keys, kind='stable')
+    cellKeys,start,count = np.unique(keys[order], return_index=True, return_counts=True)
+    cells = np.arange(len(cellKeys))
+
+    pairs_i,pairs_j = [],[]
+    for offset in [None]+[tuple(int(d) for d in o) for o in _neighborCells]:
+        if offset is None: a,b = cells,cells
+        else:
+            # Keys of the neighbor cells are sorted too, which makes the search fast
+            neighborKeys = cellKeys + ((offset[0]<<42)+(offset[1]<<21)+offset[2])
+            found = np.minimum(np.searchsorted(cellKeys, neighborKeys), len(cellKeys)-1)
+            a = np.flatnonzero(cellKeys[found]==neighborKeys)
+            b = found[a]
+        ci,cj = _cellPairs(a, b, start, count, order)
+        ci,cj = np.maximum(ci,cj),np.minimum(ci,cj)
+
+        keep = cj<ci
+        for attribute,eps in zip(attributes,epsilons):
+            keep[keep] &= np.all(np.abs(attribute[ci[keep]]-attribute[cj[keep]])<eps, axis=1)
+        pairs_i.append(ci[keep])
+        pairs_j.append(cj[keep])
+
+    pairs_i,pairs_j = np.concatenate(pairs_i),np.concatenate(pairs_j)
+    # Sorted by vertex, then by candidate
+    s = np.lexsort((pairs_j,pairs_i))
+    return pairs_i[s],pairs_j[s]
+
+def weldVBO(in_vertices,in_uvs,in_normals,
+        position_epsilon=0.01,uv_epsilon=0.01,normal_epsilon=0.01):
+
+    # Like indexVBO, but a vertex also reuses the index of a previous vertex
+    # when its position, uv and normal are within the epsilons of it, as
+    # the C++ tutorial does. Returns indices,vertices,uvs,normals and the
+    # number of vertices which were merged this way.
+
+    # Exact duplicates first
+    first,inverse = uniqueRows(np.concatenate(
+        (_bytes(in_vertices),_bytes(in_uvs),_bytes(in_normals)),axis=1))
+    vertices = np.asarray(in_vertices)[first]
+    uvs = np.asarray(in_uvs)[first]
+    normals = np.asarray(in_normals)[first]
+    n = len(first)
+
+    cell = position_epsilon if position_epsilon>0 else 1.0
+    pairs_i,pairs_j = _similarPairs(vertices.astype(np.float64),
+            (vertices,uvs,normals), (position_epsilon,uv_epsilon,normal_epsilon), cell)
+
+    # A vertex reuses the first kept vertex similar to it, and is kept if
+    # there is none. Whether a vertex is kept depends on the vertices before
+    # it, so the decisions are made in rounds, each one settling the
+    # vertices whose candidates before the first kept one are all settled.
+    UNKNOWN,KEPT,MERGED = 0,1,2
+    state = np.full(n, KEPT, dtype=np.int8)
+    state[pairs_i] = UNKNOWN
+    target = np.arange(n)
+    groups = np.flatnonzero(np.concatenate(([True],pairs_i[1:]!=pairs_i[:-1]))) if len(pairs_i) else np.zeros(0,dtype=np.int64)
+
+    while len(groups):
+        owners = pairs_i[groups]
+        # First candidate of each vertex which is not merged
+        candidate = np.where(state[pairs_j]!=MERGED, np.arange(len(pairs_j)), len(pairs_j))
+        firstCandidate = np.minimum.reduceat(candidate, groups)
+        noneLeft = firstCandidate==len(pairs_j)
+        firstState = state[pairs_j[np.minimum(firstCandidate,len(pairs_j)-1)]]
+
+        kept = noneLeft
+        merged = ~noneLeft & (firstState==KEPT)
+        state[owners[kept]] = KEPT
+        state[owners[merged]] = MERGED
+        target[owners[merged]] = pairs_j[firstCandidate[merged]]
+
+        # Drop the settled vertices
+        settled = kept|merged
+        if not settled.any(): raise RuntimeError("Vertex welding did not converge")
+        sizes = np.diff(np.concatenate((groups,[len(pairs_i)])))
+        remaining = np.repeat(~settled, sizes)
+        pairs_i,pairs_j = pairs_i[remaining],pairs_j[remaining]
+        groups = np.flatnonzero(np.concatenate(([True],pairs_i[1:]!=pairs_i[:-1]))) if len(pairs_i) else groups[:0]
+
+    # Number the kept vertices in order
+    keptVertices = np.flatnonzero(state==KEPT)
+    number = np.empty(n, dtype=np.int64)
+    number[keptVertices] = np.arange(len(keptVertices))
+
+    return (
+            indexArray(number[target[inverse]], len(keptVertices)),
+            vertices[keptVertices],
+            uvs[keptVertices],
+            normals[keptVertices],
+            n-len(keptVertices)
+            )
@@ -0,0 +1,195 @@
+import numpy as np
+from OpenGL.GL import GL_FLOAT,GL_HALF_FLOAT,GL_UNSIGNED_SHORT,GL_SHORT,GL_INT_2_10_10_10_REV
+
+# Compact encodings of the vertex attributes. loadOBJ and indexVBO give
+# float32 positions, UVs and normals, 32 bytes per vertex. With
+# float16 positions, unorm16 UVs and octahedral normals it is 16 bytes :
+#
+#   indices,vertices,uvs,normals = loadIndexedOBJ("suzanne.obj")
+#   positions = encodePositions(vertices, "float16")
+#   packedUVs,UVScaleOffset = encodeUVs(uvs, "unorm16")
+#   packedNormals = encodeNormals(normals, "octahedral")
+#   ...
+#   glVertexAttribPointer(0, *attributeFormat("float16"), 0, None)
+#
+# The StandardShadingPacked and ShadowMappingPacked vertex shaders decode
+# them : set their UVScaleOffset uniform to the one encodeUVs returns, and
+# OctahedralNormals to 1 for octahedral normals.
+#
+# Formats, for glVertexAttribPointer : (size, type, normalized)
+_formats = {
+    "float32":    (3, GL_FLOAT, False),
+    "float16":    (4, GL_HALF_FLOAT, False), # padded to 8 bytes
+    "unorm16":    (2, GL_UNSIGNED_SHORT, True),
+    "octahedral": (2, GL_SHORT, True),
+    "2_10_10_10": (4, GL_INT_2_10_10_10_REV, True),
+    }
+
+positionEncodings = ("float32", "float16")
+uvEncodings = ("float32", "float16", "unorm16")
+normalEncodings = ("float32", "float16", "octahedral", "2_10_10_10")
+
+def attributeFormat(encoding, components=3):
+    # (size, type, normalized) of an encoded attribute, components being
+    # the size of the float attribute (2 for UVs)
+    if encoding not in _formats:
+        raise RuntimeError("Unknown vertex encoding {:}".format(encoding))
+    size,glType,normalized = _formats[encoding]
+    if encoding=="float32": size = components
+    if encoding=="float16" and components==2: size = 2
+    return size,glType,normalized
+
+def _check(encoding, encodings):
+    if encoding not in encodings:
+        raise RuntimeError("Unknown vertex encoding {:}, expected one of {:}".format(encoding, encodings))
+
+def _toHalf(a, components):
+    # float16, padded with 1 to 4 components for 3 component attributes so
+    # that every vertex stays 4 bytes aligned
+    a = np.asarray(a, dtype=np.float32)
+    if components==2: return a.astype(np.float16)
+    out = np.ones((len(a),4), dtype=np.float16)
+    out[:,:3] = a
+    return out
+
+# Positions
+
+def encodePositions(vertices, encoding="float16"):
+    _check(encoding, positionEncodings)
+    if encoding=="float16": return _toHalf(vertices, 3)
+    return np.asarray(vertices, dtype=np.float32)
+
+def decodePositions(data, encoding="float16"):
+    _check(encoding, positionEncodings)
+    return np.asarray(data, dtype=np.float32)[:,:3]
+
+# UVs
+
+def encodeUVs(uvs, encoding="unorm16"):
+    # Returns the encoded UVs and the UVScaleOffset uniform, (scale, offset)
+    # with UV = encoded*scale+offset. unorm16 maps the range of the UVs
+    # (which may be outside of [0,1] when textures repeat) to [0,65535].
+    _check(encoding, uvEncodings)
+    uvs = np.asarray(uvs, dtype=np.float32)
+    scaleOffset = np.array([1.,1.,0.,0.], dtype=np.float32)
+    if encoding=="float16": return _toHalf(uvs, 2),scaleOffset
+    if encoding=="float32": return uvs,scaleOffset
+
+    low = uvs.min(axis=0) if len(uvs) else np.zeros(2)
+    high = uvs.max(axis=0) if len(uvs) else np.ones(2)
+    scale = np.where(high>low, high-low, 1.)
+    scaleOffset = np.concatenate((scale,low)).astype(np.float32)
+    data = np.rint((uvs-low)/scale*65535.)
+    return np.clip(data,0,65535).astype(np.uint16),scaleOffset
+
+def decodeUVs(data, scaleOffset, encoding="unorm16"):
+    _check(encoding, uvEncodings)
+    data = np.asarray(data, dtype=np.float32)
+    if encoding=="unorm16": data = data/65535.
+    return data*scaleOffset[:2]+scaleOffset[2:]
+
+# Normals
+
+def _signNotZero(a):
+    return np.where(a>=0., 1., -1.)
+
+def _octahedralWrap(n):
+    # Unit vectors to the [-1,1]^2 square : project on the octahedron
+    # |x|+|y|+|z|=1, then fold its lower half over the upper one
+    n = n/np.maximum(np.abs(n).sum(axis=1),1e-30)[:,None]
+    xy = n[:,:2]
+    lower = n[:,2:3]<0.
+    return np.where(lower, (1.-np.abs(xy[:,::-1]))*_signNotZero(xy), xy)
+
+def _octahedralUnwrap(e):
+    n = np.concatenate((e, (1.-np.abs(e).sum(axis=1))[:,None]), axis=1)
+    lower = n[:,2:3]<0.
+    n[:,:2] = np.where(lower, (1.-np.abs(n[:,1::-1]))*_signNotZero(n[:,:2]), n[:,:2])
+    return n/np.linalg.norm(n, axis=1)[:,None]
+
+def _snorm(a, bits):
+    # GL's conversion of normalized signed integers to floats
+    m = float((1<<(bits-1))-1)
+    return np.maximum(a/m, -1.)
+
+def encodeNormals(normals, encoding="octahedral"):
+    _check(encoding, normalEncodings)
+    normals = np.asarray(normals, dtype=np.float64)
+    if encoding=="float32": return normals.astype(np.float32)
+    if encoding=="float16": return _toHalf(normals, 3)
+
+    length = np.linalg.norm(normals, axis=1)
+    n = normals/np.where(length>0,length,1.)[:,None]
+
+    if encoding=="octahedral":
+        # Of the 4 ways to round the 2 coordinates, keep the one which
+        # decodes closest to the normal
+        e = _octahedralWrap(n)*32767.
+        best,bestError = None,None
+        for rx in (np.floor,np.ceil):
+            for ry in (np.floor,np.ceil):
+                q = np.clip(np.stack((rx(e[:,0]),ry(e[:,1])),axis=1), -32767, 32767)
+                error = -np.einsum('ij,ij->i', _octahedralUnwrap(_snorm(q,16)), n)
+                if best is None:
+                    best,bestError = q,error
+                else:
+                    better = error<bestError
+                    best[better],bestError[better] = q[better],error[better]
+        return best.astype(np.int16)
+
+    # 2_10_10_10 : 10 bits signed x, y and z, and 2 bits of w, left at 0
+    q = np.clip(np.rint(n*511.), -511, 511).astype(np.int64) & 0x3FF
+    return (q[:,0] | q[:,1]<<10 | q[:,2]<<20).astype(np.uint32)
+
+def decodeNormals(data, encoding="octahedral"):
+    _check(encoding, normalEncodings)
+    if encoding in ("float32","float16"):
+        return np.asarray(data, dtype=np.float32)[:,:3]
+    if encoding=="octahedral":
+        return _octahedralUnwrap(_snorm(np.asarray(data, dtype=np.float64),16)).astype(np.float32)
+
+    data = np.asarray(data, dtype=np.int64)
+    q = np.stack((data&0x3FF, data>>10&0x3FF, data>>20&0x3FF), axis=1)
+    q = np.where(q>=512, q-1024, q) # Sign extension
+    return _snorm(q,10).astype(np.float32)
+
+# Error report
+
+def _bytesPerVertex(data):
+    return data.nbytes//len(data) if len(data) else 0
+
+def encodingErrors(vertices, uvs, normals, positionEncoding="float16",
+        uvEncoding="unorm16", normalEncoding="octahedral"):
+
+    # Encodes and decodes the attributes, and returns for each one its
+    # bytes per vertex, and its largest and mean error : distance for the
+    # positions and the UVs, angle in degrees for the normals
+    vertices = np.asarray(vertices, dtype=np.float32)
+    uvs = np.asarray(uvs, dtype=np.float32)
+    normals = np.asarray(normals, dtype=np.float64)
+    report = {}
+
+    data = encodePositions(vertices, positionEncoding)
+    error = np.linalg.norm(decodePositions(data, positionEncoding)-vertices, axis=1)
+    report["position"] = (positionEncoding, _bytesPerVertex(data), error.max(initial=0.), error.mean() if len(error) else 0.)
+
+    data,scaleOffset = encodeUVs(uvs, uvEncoding)
+    error = np.linalg.norm(decodeUVs(data, scaleOffset, uvEncoding)-uvs, axis=1)
+    report["uv"] = (uvEncoding, _bytesPerVertex(data), error.max(initial=0.), error.mean() if len(error) else 0.)
+
+    data = encodeNormals(normals, normalEncoding)
+    decoded = decodeNormals(data, normalEncoding).astype(np.float64)
+    # atan2 rather than acos, which is too coarse for small angles
+    sine = np.linalg.norm(np.cross(normals, decoded), axis=1)
+    error = np.degrees(np.arctan2(sine, np.einsum('ij,ij->i', normals, decoded)))
+    report["normal"] = (normalEncoding, _bytesPerVertex(data), error.max(initial=0.), error.mean() if len(error) else 0.)
+
+    return report
+
+def printEncodingErrors(report):
+    total = sum(r[1] for r in report.values())
+    for name,(encoding,size,maxError,meanError) in report.items():
+        unit = " deg" if name=="normal" else ""
+        print("  {:<8} {:<11} {:2} bytes   max error {:.3g}{:}   mean error {:.3g}{:}"
+                .format(name, encoding, size, maxError, unit, meanError, unit))
+    print("  {:} bytes per vertex, instead of 32".format(total))